@@ -0,0 +1,259 @@
+"""
+Benchmarks every Cosmocalc method for every preset cosmology in cosmo_params.yaml,
+plus closed, open and evolving dark energy cases.
+
+Each method is timed for a scalar redshift, a 100-point plot grid like the ones from
+calc_session.get_zs and a 1e6-element array. The evaluations per second, the peak
+memory allocated during a call and the largest relative error against a high-precision
+quad reference are written to JSON, which can be compared against a stored baseline:
+
+    python benchmark_cosmocalc.py --output benchmark_results.json
+    python benchmark_cosmocalc.py --baseline benchmark_results.json
+
+The cold start, i.e. the time to import cosmocalc and the latency of the first result in
+a fresh interpreter, is measured too and stored under 'startup'.
+
+The comparison exits with status 1 if any method became slower or less accurate than allowed.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+import tracemalloc
+import warnings
+from datetime import datetime, timezone
+
+import numpy as np
+import scipy
+from scipy.integrate import IntegrationWarning, quad
+
+import cosmocalc
+from cosmocalc import Cosmocalc, cosmo_input_params, result_cache, result_quantities
+
+# cosmologies benchmarked besides the presets of model_dict
+EXTRA_CASES = {
+    'closed': {'H0': 70.0, 'w': -1, 'wa': 0, 'omega_rad': 0, 'omega_M': 0.5, 'omega_Lambda': 0.7},
+    'open': {'H0': 70.0, 'w': -1, 'wa': 0, 'omega_rad': 0, 'omega_M': 0.3, 'omega_Lambda': 0.5},
+    'cpl_radiation': {'H0': 70.0, 'w': -0.9, 'wa': 0.2, 'omega_rad': 1e-4, 'omega_M': 0.3, 'omega_Lambda': 0.7},
+}
+
+SIZES = {
+    'scalar': lambda: 1.0,
+    'grid': lambda: np.linspace(0, 5, 101)[1:],  # as get_zs((0, 5))
+    'array_1e6': lambda: np.random.default_rng(0).uniform(0, 10, 1_000_000),
+}
+
+# a method is flagged when its throughput drops below (1 - SPEED_TOLERANCE) of the baseline,
+# or its error grows beyond ACCURACY_FACTOR times the baseline and above ACCURACY_FLOOR
+SPEED_TOLERANCE = 0.2
+ACCURACY_FACTOR = 10
+ACCURACY_FLOOR = 1e-12
+
+REFERENCE_RTOL = 1e-13
+
+# timed rounds per benchmark, each at least 0.2 s long; the fastest round is kept
+REPEAT = 5
+
+# the cold start is measured in this many fresh interpreters, the median is kept
+STARTUP_RUNS = 7
+STARTUP_SCRIPT = '''
+import time
+start =time.perf_counter()
+import cosmocalc
+imported = time.perf_counter()
+cosmocalc.Cosmocalc(70, -1, 0, 0, 0.3, 0.7).luminosity_distance(1.0)
+print(imported - start, time.perf_counter() - start)
+'''
+
+
+class ReferenceCosmocalc(Cosmocalc):
+    """
+    Cosmocalc evaluating every integral point by point with tightly converged quad calls.
+    The age integral is carried out over the scale factor, da/(aE), from 0 to 1/(1+z).
+    """
+
+    def _direct_integrals(self, x, los=True, age=True):
+        z = np.expm1(np.asarray(x, dtype=float))
+        rows = []
+        if los:
+            rows.append(self._quad_each(self._freidman, z))
+        if age:
+            rows.append(self._quad_each(self._tage_int, z))
+            rows.append(np.vectorize(self._age_from_scale_factor)(1/(1+z)))
+        return np.array(rows)
+
+    def _quad_each(self, integrand, z):
+        return np.vectorize(lambda zz: quad(integrand, 0, zz, epsabs=0, epsrel=REFERENCE_RTOL, limit=500)[0])(z)
+
+    def _age_from_scale_factor(self, a):
+        # numpy floats overflow to inf, where the integrand vanishes, as a goes to 0
+        with np.errstate(over='ignore', invalid='ignore'):
+            return quad(lambda a: 1/(a*self._E(np.float64(1/a - 1))), 0, a,
+                        epsabs=0, epsrel=REFERENCE_RTOL, limit=500)[0]
+
+    def _age_today_integral(self):
+        return self._age_from_scale_factor(1.0)
+
+
+def load_cases(path: str = cosmocalc.PARAMS_FILE):
+    cases = {name: model['param'] for name, model in cosmocalc.load_config(path)['model_dict'].items()}
+    cases.update(EXTRA_CASES)
+    return cases
+
+
+def call(calc: Cosmocalc, method: str, z):
+    if method == 'age_today':
+        return calc.age_today()
+    return getattr(calc, method)(z)
+
+
+def time_method(calc: Cosmocalc, method: str, z, repeat: int):
+    """
+    Returns the wall time per call, the best of `repeat` rounds, with the shared result
+    cache cleared before each call, and the peak memory allocated during a call in MB.
+    Every round runs as many calls as timeit's autorange needs to last at least 0.2 s,
+    so that fast methods are not timed from single calls near the clock's resolution.
+    """
+    def cold_call():
+        result_cache.clear()
+        call(calc, method, z)
+
+    timer = timeit.Timer(cold_call)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat, number))/number
+    result_cache.clear()
+    tracemalloc.start()
+    call(calc, method, z)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak/2**20
+
+
+def max_relative_error(calc: Cosmocalc, reference: Cosmocalc, method: str, z):
+    # divergent reference integrals (e.g. the age of de Sitter) are skipped, as are undefined
+    # results, e.g. the distance modulus where the transverse distance of a closed universe is negative
+    with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+        warnings.simplefilter('ignore', IntegrationWarning)
+        expected = np.asarray(call(reference, method, z))
+        error = np.abs(np.asarray(call(calc, method, z))/expected - 1)
+    error = error[np.isfinite(error)]
+    return float(error.max()) if error.size else None
+
+
+def run(cases: dict, sizes=tuple(SIZES), methods=tuple(result_quantities), repeat: int = REPEAT):
+    results = {}
+    for case, params in cases.items():
+        values = [float(params[p]) for p in cosmo_input_params]
+        calc, reference = Cosmocalc(*values), ReferenceCosmocalc(*values)
+        results[case] = {}
+        for method in methods:
+            results[case][method] = {}
+            # the age today does not depend on z, it is timed once
+            for size in (sizes[:1] if method == 'age_today' else sizes):
+                z = SIZES[size]()
+                seconds, memory = time_method(calc, method, z, repeat)
+                evaluations = np.size(z)
+                results[case][method][size] = {
+                    'seconds': seconds,
+                    'evaluations_per_second': evaluations/seconds,
+                    'peak_memory_mb': memory,
+                    # the reference is too slow for the large arrays, which share the grid's code path
+                    'max_relative_error': None if size == 'array_1e6' else max_relative_error(calc, reference, method, z),
+                }
+            print(f'{case:>16} {method:<26}' + ''.join(
+                f' {size}: {timing["evaluations_per_second"]:.3g}/s' for size, timing in results[case][method].items()),
+                file=sys.stderr)
+    return {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'machine': platform.machine(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def measure_startup(runs: int = STARTUP_RUNS):
+    """
+    Returns the median time in seconds to import cosmocalc, and to get the first
+    luminosity distance after the interpreter started, each in a fresh process.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [
+        os.path.dirname(os.path.abspath(cosmocalc.__file__)), os.environ.get('PYTHONPATH')])))
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], env=env, check=True,
+                                capture_output=True, text=True).stdout
+        timings.append([float(t) for t in output.split()])
+    import_seconds, first_result_seconds = np.median(timings, axis=0)
+    print(f'{"startup":>16} import: {1e3*import_seconds:.0f} ms, '
+          f'first result: {1e3*first_result_seconds:.0f} ms', file=sys.stderr)
+    return {'import_seconds': float(import_seconds), 'first_result_seconds': float(first_result_seconds)}
+
+
+def compare(current: dict, baseline: dict, speed_tolerance: float = SPEED_TOLERANCE):
+    """
+    Returns a list of messages, one per benchmark that regressed against the baseline.
+    Benchmarks missing from either run are skipped.
+    """
+    regressions = []
+    for case, methods in current['results'].items():
+        for method, sizes in methods.items():
+            for size, now in sizes.items():
+                before = baseline['results'].get(case, {}).get(method, {}).get(size)
+                if before is None:
+                    continue
+                name = f'{case}/{method}/{size}'
+                if now['evaluations_per_second'] < (1 - speed_tolerance)*before['evaluations_per_second']:
+                    regressions.append(f'{name}: {now["evaluations_per_second"]:.3g} evaluations/s, '
+                                       f'baseline {before["evaluations_per_second"]:.3g}')
+                if now['max_relative_error'] is not None and before['max_relative_error'] is not None \
+                        and now['max_relative_error'] > max(ACCURACY_FACTOR*before['max_relative_error'], ACCURACY_FLOOR):
+                    regressions.append(f'{name}: relative error {now["max_relative_error"]:.3g}, '
+                                       f'baseline {before["max_relative_error"]:.3g}')
+    for name, now in current.get('startup', {}).items():
+        before = baseline.get('startup', {}).get(name)
+        if before is not None and now > before/(1 - speed_tolerance):
+            regressions.append(f'startup/{name}: {1e3*now:.0f} ms, baseline {1e3*before:.0f} ms')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file to write')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare against')
+    parser.add_argument('--cases', nargs='+', help='cosmologies to run, defaults to all')
+    parser.add_argument('--methods', nargs='+', choices=result_quantities, default=result_quantities)
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='timed rounds per benchmark, the best is kept')
+    parser.add_argument('--startup-runs', type=int, default=STARTUP_RUNS,
+                        help='fresh interpreters timed for the cold start, 0 to skip it')
+    parser.add_argument('--speed-tolerance', type=float, default=SPEED_TOLERANCE,
+                        help='allowed relative drop in evaluations per second')
+    args = parser.parse_args(argv)
+
+    cases = load_cases()
+    if args.cases:
+        cases = {name: cases[name] for name in args.cases}
+    current = run(cases, args.sizes, args.methods, args.repeat)
+    if args.startup_runs:
+        current['startup'] = measure_startup(args.startup_runs)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(current, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = compare(current, json.load(file), args.speed_tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,36 @@
 import streamlit as st
 import numpy as np
-import pandas as pd
-import yaml
-import plotly.express as px
-from cosmocalc import cosmo_input_params, Cosmocalc
+from cosmocalc import cosmo_input_params, Cosmocalc, LRUCache, instrumentation, load_config
+# pandas and plotly are imported where the tables and plots are drawn
 
 
 # ---- configuration --------------------------------
 st.set_page_config(layout='wide')
+PLOT_CACHE_SIZE = 256  # figures, 8 per cosmology and redshift range
+RESULT_PAGE_SIZE = 50  # rows of the result table shown at a time
 
 # ---------------------load parameters-------------------------------------------
-with open('cosmo_params.yaml', 'r', encoding='utf-8') as file:
-    params = yaml.safe_load(file)
+# parsed once per process and shared by every rerun and session
+params = load_config()
 
 cosmology_model_dict = params['model_dict']
 input_param_dict = params['input_param_dict']
 result_dict = params['result_dict']
 
+
+@st.cache_resource
+def get_plot_cache():
+    """
+    Returns the process-wide cache of plot figures, keyed on the cosmology, the redshift
+    range, the number of points and the attribute. It outlives reruns and is shared by all
+    sessions, and it is bounded to PLOT_CACHE_SIZE figures, evicting the least recently used.
+    """
+    return LRUCache(PLOT_CACHE_SIZE)
+
+
+plot_cache = get_plot_cache()
+instrumentation.caches['plot_cache'] = plot_cache
+
 # ----------------------utilities------------------------------------
 
 
@@ -52,9 +66,9 @@ def num_formatter(num: float or np.ndarray, decimal=2):
     - float: Formatted number with the specified number of decimal places
     """
     try:
-        if type(num) is float:
+        if isinstance(num, float):
             return round(num, decimal)
-        if type(num) is np.ndarray:
+        if isinstance(num, np.ndarray):
             return np.around(num, decimal)
         else:
             raise TypeError
@@ -62,22 +76,6 @@ def num_formatter(num: float or np.ndarray, decimal=2):
         return st.error(e)
 
 
-def update_cosmo_param(obj: Cosmocalc, param, value):
-    """
-    This function updates a parameter 'param' of an object 'obj' with the given 'value'.
-
-    Args:
-    - obj (Cosmocalc): Object whose parameter needs to be updated
-    - param (str): Name of the parameter to update
-    - value (Any): Value to be assigned to the parameter
-
-    Returns:
-    - None
-    """
-    if param in dir(obj) and not callable(getattr(obj, param)):
-        setattr(obj, param, value)
-
-
 def update_cosmo_params(obj: Cosmocalc, *args, **kwargs):
     """
     This function updates multiple parameters of an object 'obj' using positional and/or
@@ -99,11 +97,9 @@ def update_cosmo_params(obj: Cosmocalc, *args, **kwargs):
                   parameters defined in 'cosmo_input_params'
     """
     if len(args) == len(cosmo_input_params):
-        for key, value in zip(cosmo_input_params, args):
-            setattr(obj, key, value)
+        obj.set_params(**dict(zip(cosmo_input_params, args)))
     elif all(key in cosmo_input_params for key in kwargs):
-        for key, value in kwargs.items():
-            setattr(obj, key, value)
+        obj.set_params(**kwargs)
     else:
         raise ValueError(
             'The number of arguments/ keyword arguments are not supported')
@@ -126,10 +122,62 @@ def change_cosmo(option: str):
 
 def clear_result_chart(cond:bool=True):
     """
-    initialises the result chart
+    initialises the result chart, i.e. the sorted array of redshifts in the result table
     """
-    if 'result' not in st.session_state or cond: 
-        st.session_state['result'] = None
+    if 'redshifts' not in st.session_state or cond:
+        st.session_state['redshifts'] = np.empty(0)
+
+
+def add_redshifts(zs):
+    """
+    Adds redshifts to the result table. Only the sorted, unique redshifts are kept in the
+    session state, as one float array; negative and non-finite values are dropped.
+
+    Args:
+    - zs (array-like): The redshifts to add.
+
+    Returns:
+    - int: The number of values dropped.
+    """
+    zs = np.asarray(zs, dtype=float).ravel()
+    valid = np.isfinite(zs) & (zs >= 0)
+    st.session_state['redshifts'] = np.union1d(st.session_state['redshifts'], zs[valid])
+    return int(np.count_nonzero(~valid))
+
+
+def parse_redshifts(text: str):
+    """
+    Parses redshifts separated by commas, semicolons, spaces or new lines.
+
+    Raises:
+    - ValueError: If an entry is not a number.
+    """
+    import re
+    entries = [entry for entry in re.split(r'[,;\s]+', text.strip()) if entry]
+    return np.array(entries, dtype=float)
+
+
+def read_redshift_file(file):
+    """
+    Reads the redshifts of an uploaded file: a 1-d array in .npy, one value per line in
+    .txt, or the 'z' column (else the first column) of a .csv or .parquet table.
+
+    Raises:
+    - ValueError: If the file format is not supported or the values are not numbers.
+    """
+    import io
+    import os
+    import pandas as pd
+    extension = os.path.splitext(file.name)[1].lower()
+    data = io.BytesIO(file.getvalue())
+    if extension == '.npy':
+        return np.load(data, allow_pickle=False).astype(float)
+    if extension == '.txt':
+        return parse_redshifts(data.read().decode())
+    if extension in ('.csv', '.parquet'):
+        table = pd.read_csv(data) if extension == '.csv' else pd.read_parquet(data)
+        return table['z' if 'z' in table else table.columns[0]].to_numpy(dtype=float)
+    raise ValueError(f'Unsupported file format {extension}, use .csv, .txt, .npy or .parquet')
 
 # -----------------------Output --------------------------------
 
@@ -150,40 +198,32 @@ def calculate_cosmo_attribute(_func_name: str, z, rounding=True):
     --------
     np.ndarray or float
         The calculated cosmological attribute values for the input redshift values.
+        The `Cosmocalc` methods accept arrays directly, so a whole grid is evaluated in one call.
     """
     try:
-        cm = np.vectorize(getattr(st.session_state['cosmo'], _func_name))
+        cm = getattr(st.session_state['cosmo'], _func_name)
         return num_formatter(cm(z))
     except AttributeError as e:
         return st.error(e)
 
 
-# @st.cache_data
-# for the result of the calculation
-def calculate_cosmo_attributes_z(z, df=None):
+def calculate_results_table(z):
     """
-    This function calculates the values of various cosmological parameters \
-        at a given redshift value 'z'.
+    This function calculates the values of all cosmological parameters in result_dict
+    at the redshifts 'z', in one vectorized call.
+    The values are cached process-wide by `Cosmocalc.evaluate`, so sessions using the
+    same cosmology share one computation.
 
     Parameters:
-    z (float): 
-    df (pandas.DataFrame, optional): A pandas dataframe.
-                                      If not provided, a new dataframe will be created.
+    z (np.ndarray): The redshifts.
 
     Returns:
-    pandas.DataFrame: A pandas dataframe.                      
+    pandas.DataFrame: A numeric table with a float column for z and for every parameter,
+                      named as in result_dict. Formatting is left to the display.
     """
-    try:
-        attributes = [result_dict[c]['mask'] for c in result_dict]
-        values = [
-            f'{calculate_cosmo_attribute(c,z)} {result_dict[c]["unit"]}' for c in result_dict]
-        if df is None:
-            df = pd.DataFrame({f'Values at {num_formatter(z)}': values}, index=attributes)
-        else:
-            df[f'Values at {num_formatter(z)}'] = values
-        return df
-    except Exception as e:
-        st.error(e)
+    import pandas as pd
+    results = st.session_state['cosmo'].evaluate(z, list(result_dict))
+    return pd.DataFrame({'z': z, **{c: np.asarray(results[c], dtype=float) for c in result_dict}})
 
 
 @st.cache_data(experimental_allow_widgets=True, max_entries=1000)
@@ -219,19 +259,24 @@ def get_zs(z_range,num_points: int = 100, diverging_value=5, offset=1e-1):
 # @st.cache_data
 
 
-def plot_cosmo_attribute(funcname: str, z: np.ndarray, result_dict: dict = result_dict):
+@instrumentation.timed()
+def plot_cosmo_attribute(funcname: str, z: np.ndarray, values: np.ndarray = None, result_dict: dict = result_dict):
     """
     Plot the variation of a given cosmological attribute with redshift.
 
     Args:
     - funcname (str): Name of the cosmological attribute to be plotted.
     - z (numpy.ndarray): Redshift values.
+    - values (numpy.ndarray, optional): Precomputed values of the attribute at z.
+                                        If not provided, they are calculated here.
     - **kwargs: Keyword arguments to be passed to the plot.
 
     Returns:
     - fig (plotly.graph_objs._figure.Figure): A plotly figure object.
     """
-    values = calculate_cosmo_attribute(funcname, z)
+    import pandas as pd
+    import plotly.express as px
+    values = calculate_cosmo_attribute(funcname, z) if values is None else num_formatter(values)
     df = pd.DataFrame(np.column_stack((z, values)),
                       columns=['redshift', funcname])
     fig = px.line(df,
@@ -268,8 +313,9 @@ def initialize_session_data():
         if 'cosmology_model' not in st.session_state:
             st.session_state['cosmology_model'] = 'concordance'
         change_cosmo(st.session_state['cosmology_model'])
+        # plots and the two-decimal table do not need more than the display accuracy
         st.session_state['cosmo'] = Cosmocalc(
-            *arg_parser(cosmo_input_params, st.session_state))
+            *arg_parser(cosmo_input_params, st.session_state), accuracy='display')
         st.session_state['z'] = 1.0
         #st.session_state['max_z']=100        
         clear_result_chart(False)
@@ -321,8 +367,8 @@ def display_input_control():
     For each parameter in the input_param_dict, a number input control is shown in the sidebar
     with a label, a default value, and minimum and maximum values (if applicable).
     The current value of the parameter is set in the session state.
-    If the parameter is included in cosmo_input_params, the corresponding parameter
-    value in the cosmology calculator object is updated with the new value.
+    The cosmological parameters of the calculator object are then updated in one batch,
+    which recomputes its derived state only if a value changed.
 
     Returns:
         None
@@ -342,33 +388,83 @@ def display_input_control():
                                                           min_value=min_val,
                                                           max_value=max_val,
                                                           help=input_param_dict[param]['description'],
-                                                          on_change=(lambda param=param: clear_result_chart() \
-                                                                     if param!='z' else None) ,
                                                           #args=(param,)
                                                           )
-        if param in cosmo_input_params:
-            update_cosmo_param(
-                st.session_state['cosmo'], param, st.session_state[param])
+    # one batched update, which recomputes nothing when no parameter changed
+    update_cosmo_params(st.session_state['cosmo'], **{param: st.session_state[param] for param in cosmo_input_params})
 
 
+def display_redshift_upload():
+    """
+    Displays the controls for adding many redshifts at once, pasted as text or uploaded
+    as a file. Each uploaded file is added once, so that clearing the table sticks.
+    """
+    with st.expander('Add many redshifts'):
+        text = st.text_area('Paste redshifts', help='Separated by commas, spaces or new lines')
+        file = st.file_uploader('or upload a file', type=['csv', 'txt', 'npy', 'parquet'],
+                                help="A .csv or .parquet table with a 'z' column (else the first column is used), "
+                                     'a .txt file or a 1-d .npy array')
+        try:
+            zs = []
+            if st.button('Add redshifts') and text.strip():
+                zs.append(parse_redshifts(text))
+            if file is not None and st.session_state.get('uploaded_file') != (file.name, file.size):
+                st.session_state['uploaded_file'] = (file.name, file.size)
+                zs.append(read_redshift_file(file))
+            dropped = add_redshifts(np.concatenate(zs)) if zs else 0
+            if dropped:
+                st.warning(f'{dropped} negative or non-finite redshifts were ignored')
+        except (ValueError, KeyError, IndexError) as e:
+            st.error(f'Could not read the redshifts: {e}')
+
+
+def display_result_downloads(df):
+    """
+    Displays buttons downloading the numeric result table as CSV and as Parquet.
+    """
+    import io
+    c1, c2, _ = st.columns([1, 1, 4])
+    with c1:
+        st.download_button('Download CSV', df.to_csv(index=False).encode(),
+                           file_name='cosmocalc_results.csv', mime='text/csv')
+    with c2:
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        st.download_button('Download Parquet', buffer.getvalue(),
+                           file_name='cosmocalc_results.parquet', mime='application/octet-stream')
+
+
+@instrumentation.timed()
 def display_results():
     """
-    Displays the results of the cosmological calculation as a Pandas dataframe.
+    Displays the results of the cosmological calculation at every redshift entered or
+    added, as a paginated table. The values are formatted for display only; the
+    downloads hold the full-precision numbers.
     """
-    st.caption("""By default, when a cosmological input parameter other than z changes,\
-                    the result table will be refreshed""")
-        
-    # if 'result' not in st.session_state or st.button('Clear'):
-    #     st.session_state['result'] = None
-    st.session_state['result'] = calculate_cosmo_attributes_z(
-        st.session_state['z'], st.session_state['result'])
-    st.dataframe(st.session_state['result'])
+    st.caption("""The current z is added to the table, and the whole table is recomputed\
+                    whenever a cosmological input parameter changes""")
+    display_redshift_upload()
+    add_redshifts([st.session_state['z']])
+    z = st.session_state['redshifts']
+    try:
+        df = calculate_results_table(z)
+    except Exception as e:
+        st.error(e)
+        return
+    n_pages = max(-(-len(df) // RESULT_PAGE_SIZE), 1)
+    page = st.number_input(f'Page (of {n_pages}, {len(df)} redshifts)', min_value=1, max_value=n_pages,
+                           value=1, step=1, key='result_page') if n_pages > 1 else 1
+    start = (page - 1)*RESULT_PAGE_SIZE
+    shown = df.iloc[start:start + RESULT_PAGE_SIZE].rename(
+        columns={c: f'{result_dict[c]["mask"]} ({result_dict[c]["unit"]})' for c in result_dict})
+    st.dataframe(shown.style.format(precision=2).format('{:g}', subset=['z']), use_container_width=True)
+    display_result_downloads(df)
     if st.button('Clear Table'):
         clear_result_chart()
-        #st.session_state['result'] = None
         st.experimental_rerun()
 
 
+@instrumentation.timed()
 def display_cosmo_plots():
     """
     Display cosmology plots for various attributes.
@@ -379,12 +475,34 @@ def display_cosmo_plots():
     with c2:
         z_range = st.slider('range of redshift', 0, st.session_state['max_z'], (0, 5), )
     
-    zs = get_zs(z_range)
+    num_points = 100
+    zs = get_zs(z_range, num_points)
+    cosmo = st.session_state['cosmo']
+    attributes = [att for att in result_dict if att != 'age_today']
+    curves = {}
+
+    def make_figure(att):
+        # on the first miss, all curves are sampled at once on redshifts adapted to their
+        # shapes, at most num_points of them between the ends of the get_zs grid; a range of
+        # zero width leaves nothing to adapt to and is drawn on the get_zs points
+        if not curves:
+            if 0 < zs[0] < zs[-1]:
+                curves['z'], values = cosmo.sample_redshifts(zs[0], zs[-1], attributes, max_points=num_points)
+            else:
+                curves['z'], values = zs, cosmo.evaluate(zs, attributes)
+            curves.update(values)
+        return plot_cosmo_attribute(att, curves['z'], curves[att])
+
     col1, _, col2 = st.columns([2, 0.2, 2])
     for i, att in enumerate(result_dict):
         if att == 'age_today':
             continue
-        fig = plot_cosmo_attribute(att, zs)
+        try:
+            fig = plot_cache.get_or_compute((cosmo.params, cosmo.accuracy, tuple(z_range), num_points, att),
+                                            lambda att=att: make_figure(att))
+        except ValueError as e:
+            st.error(f'The curves could not be calculated: {e}')
+            return
         # if 'time' in att or 'age' in att:
         if i % 2 == 0:
             with col1:
@@ -394,6 +512,32 @@ def display_cosmo_plots():
                 st.plotly_chart(fig, use_container_width=True)
 
 
+def toggle_instrumentation():
+    """
+    Switches the instrumentation on or off when a session changes its checkbox.
+    """
+    instrumentation.enabled = st.session_state['instrumentation']
+
+
+def display_debug_panel():
+    """
+    Displays the instrumentation switch and, when it is on, the integrand evaluation counts,
+    timings and cache hit rates in the sidebar. The switch and the statistics are process-wide:
+    the switch applies to every session of the server and only changes when a checkbox is
+    clicked, and the statistics include the work of every session since the last reset.
+    """
+    # the checkbox shows the process-wide state, which another session may have changed
+    st.session_state['instrumentation'] = instrumentation.enabled
+    with st.sidebar.expander('Debug'):
+        st.checkbox('Instrumentation', key='instrumentation', on_change=toggle_instrumentation,
+                    help='Count integrand evaluations and time every calculation and stage, '
+                         'for all sessions of the server')
+        if st.session_state['instrumentation']:
+            if st.button('Reset statistics'):
+                instrumentation.reset()
+            st.json(instrumentation.report())
+
+
 def main():
     """
     main program for the University of Melbourne Astrophysics Department Cosmology Calculator.
@@ -410,6 +554,7 @@ def main():
         display_results()
     with tab2:
         display_cosmo_plots()
+    display_debug_panel()
 
     st.markdown('')
     st.caption('(1) M. Chevallier and D. Polarski, Int. J. Mod. Phys. D 10, 213 (2001),\
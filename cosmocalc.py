@@ -1,15 +1,889 @@
-import math
+import hashlib
+import itertools
+import os
+import sys
+import time
+import threading
+import types
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from typing import NamedTuple
 import numpy as np
-from scipy.integrate import quad
-from astropy import constants as const
+# scipy, yaml and the multiprocessing, IO and command line dependencies are imported
+# where they are used, so that importing this module stays fast
+
+# part of the key of every persistent cache entry; bump it whenever results change
+__version__ = '1.1.0'
 
 # -------------------------------constants
-c = const.c.to('km/s').value
+c = 299792.458  # speed of light in km/s, exact by the definition of the metre
 mpc = 3.08567758147e+19
 seconds_in_a_year = 31557600  # julian
+gravitational_constant = 6.67430e-11  # m^3/kg/s^2
+solar_mass = 1.988409870698051e+30  # kg, nominal solar mass parameter over G
 
 
 cosmo_input_params = ['H0', 'w', 'wa', 'omega_rad', 'omega_M', 'omega_Lambda']
+distance_quantities = ['comoving_distance', 'angular_diameter_distance', 'luminosity_distance',
+                       'comoving_volume', 'comoving_volume_element', 'distance_modulus']
+result_quantities = distance_quantities + ['age_at_z', 'light_travel_time', 'age_today']
+invertible_quantities = ['comoving_distance', 'luminosity_distance', 'comoving_volume',
+                         'distance_modulus', 'age_at_z', 'light_travel_time']
+jacobian_quantities = ['comoving_distance', 'angular_diameter_distance', 'luminosity_distance',
+                       'distance_modulus', 'age_at_z', 'light_travel_time', 'age_today']
+
+# -------------------------------quadrature
+# the line-of-sight integrals are evaluated with fixed-order Gauss-Legendre panels in
+# ln(1+z); no panel is wider than GL_PANEL_WIDTH so the integrand stays well resolved
+GL_ORDER = 8
+GL_PANEL_WIDTH = 0.1
+# the age integral runs over the finite interval of s = sqrt(a), 0 < s <= 1; beyond
+# AGE_SPLIT_Z the age is integrated directly instead of subtracting the lookback integral
+# from the age today, which would lose relative precision as the age goes to zero;
+# the narrower panels in s resolve the radiation era near s = 0, on the scale
+# sqrt(omega_rad/omega_M) of matter-radiation equality
+AGE_SPLIT_Z = 1.0
+AGE_PANEL_WIDTH = 0.005
+# the line-of-sight integral to z = infinity is finite when its integrand in ln(1+z),
+# (1+z)/E, falls off as a power of 1+z, which is checked between these two redshifts;
+# without matter or radiation (e.g. the empty and de Sitter universes) it diverges
+INFINITE_Z_PROBES = (1.e50, 1.e100)
+# the panel layouts of recently integrated grids of up to LAYOUT_CACHE_MAX_POINTS limits are
+# kept, so that a grid evaluated for many cosmologies, like a plot grid, is laid out once
+LAYOUT_CACHE_SIZE = 64
+LAYOUT_CACHE_MAX_POINTS = 4096
+
+# -------------------------------closed forms
+# parameters within this tolerance of zero count as vanishing when detecting the special
+# cosmologies; below CLOSED_FORM_MIN_Z the closed forms lose relative precision through
+# cancellation, and the short numerical integral is used instead
+CLOSED_FORM_TOLERANCE = 1.e-15
+CLOSED_FORM_MIN_Z = 1.e-2
+
+# below this |omega_k| (r/DH)^2 the curved comoving volume, and the derivative of the
+# transverse distance with respect to omega_k, are evaluated as series
+VOLUME_SERIES_LIMIT = 1.e-3
+
+# -------------------------------accuracy profiles
+# quadrature order and panel widths, and the default table error target, of each profile;
+# 'rtol' is the relative error the profile is verified against by verify_accuracy.py;
+# 'fixed_grid' profiles integrate over panels of the full width regardless of the points,
+# and interpolate the integrand within the panel of each point, see _fixed_grid_integral
+ACCURACY_PROFILES = {
+    'display': {'order': 5, 'panel_width': 0.05, 'age_panel_width': 0.005, 'fixed_grid': True,
+                'table_rtol': 1e-5, 'rtol': 1e-5},
+    'standard': {'order': GL_ORDER, 'panel_width': GL_PANEL_WIDTH, 'age_panel_width': AGE_PANEL_WIDTH,
+                 'fixed_grid': False, 'table_rtol': 1e-8, 'rtol': 1e-8},
+    'precision': {'order': 16, 'panel_width': 0.05, 'age_panel_width': 0.01, 'fixed_grid': False,
+                  'table_rtol': 1e-11, 'rtol': 1e-11},
+}
+DEFAULT_ACCURACY = 'standard'
+
+# -------------------------------interpolation tables
+TABLE_Z_MAX = 1100.0
+TABLE_MIN_NODES = 64
+TABLE_MAX_NODES = 2**16
+# inverse functions: table accuracy and Newton polishing steps in ln(1+z)
+INVERSE_TABLE_RTOL = 1e-10
+# the first guess from the inverse spline is within about the table accuracy, which one
+# Newton step squares, so a fixed number of steps is taken without convergence checks
+NEWTON_ITERATIONS = 1
+
+# -------------------------------adaptive sampling
+# curves are refined in log z until linear interpolation between samples is within
+# ADAPTIVE_RTOL of each quantity's range, starting from ADAPTIVE_INITIAL_POINTS samples
+ADAPTIVE_RTOL = 1e-3
+ADAPTIVE_INITIAL_POINTS = 17
+ADAPTIVE_MAX_POINTS = 100
+
+# -------------------------------linear growth
+# the growth equation is integrated in ln(a) from GROWTH_START_Z, where the growing mode of
+# a universe of matter and radiation, D proportional to a + 2/3 a_eq, sets the initial values
+# and is used for higher redshifts; dark energy and curvature are assumed negligible there
+GROWTH_START_Z = 1.e7
+# the step tolerance relative to the profile's rtol, as the local errors add up over the
+# steps, and the largest step in ln(a), which keeps the dense output accurate between steps
+GROWTH_RTOL_FACTOR = 1.e-2
+GROWTH_MAX_STEP = 0.5
+
+# -------------------------------dark energy
+# the density of a user-supplied equation of state w(z) is integrated once at DARK_ENERGY_NODES
+# points evenly spaced in ln(1+z) up to DARK_ENERGY_Z_MAX, plus the redshifts of a tabulated w,
+# and w is held at its last value beyond
+DARK_ENERGY_Z_MAX = 1.e4
+DARK_ENERGY_NODES = 1024
+
+# -------------------------------volume sampling
+# the cumulative weighted volume is integrated up to VOLUME_SAMPLER_NODES redshifts evenly
+# spaced in ln(1+z), and inverted at VOLUME_SAMPLER_QUANTILES evenly spaced cube roots of
+# the volume counted from z=0, so that every draw is one constant-time table lookup; the
+# volume grows as z**3 at low redshift, where the redshift is then linear in the cube root
+VOLUME_SAMPLER_NODES = 4096
+VOLUME_SAMPLER_QUANTILES = 2**16
+FULL_SKY = 4*np.pi*(180/np.pi)**2  # square degrees
+
+# -------------------------------shared cache
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_MAX_BYTES = 128*2**20  # least recently used entries are evicted beyond this
+RESULT_CACHE_MAX_ARRAY_SIZE = 100_000  # larger redshift arrays are never cached
+
+# -------------------------------disk cache
+# precomputed tables are kept across processes in this directory, when it is set
+DISK_CACHE_DIR = os.environ.get('COSMOCALC_CACHE_DIR')
+DEFAULT_DISK_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'cosmocalc')
+DISK_CACHE_FORMAT = 1  # layout of the entry files
+DISK_CACHE_MAX_BYTES = 256*2**20  # least recently used entries are deleted beyond this
+
+
+@lru_cache(maxsize=None)
+def _gauss_legendre(order: int = GL_ORDER):
+    """
+    Returns the Gauss-Legendre nodes and weights mapped onto the unit interval [0, 1].
+    """
+    nodes, weights = np.polynomial.legendre.leggauss(order)
+    return (nodes + 1) / 2, weights / 2
+
+
+@lru_cache(maxsize=None)
+def _partial_gauss_legendre(order: int = GL_ORDER):
+    """
+    Returns the matrix mapping the powers t**0 ... t**order to the weights that integrate,
+    from 0 to t, the polynomial interpolating an integrand at the Gauss-Legendre nodes of
+    the unit interval. At t = 1 these are the Gauss-Legendre weights.
+    """
+    nodes, _ = _gauss_legendre(order)
+    lagrange = np.linalg.inv(np.vander(nodes, order, increasing=True))  # (power, node)
+    return np.vstack((np.zeros(order), lagrange/np.arange(1, order + 1)[:, None]))
+
+
+class _PanelLayout(NamedTuple):
+    # Gauss-Legendre panels covering sorted, unique integration limits, see _panel_layout
+    nodes: np.ndarray  # (panels, order) integration nodes
+    widths: np.ndarray  # (panels,) panel widths
+    weights: np.ndarray  # (order,) weights on the unit interval
+    ends: np.ndarray  # panel count before each unique limit
+    inverse: np.ndarray  # index of every finite limit, and lastly of x0, into the unique limits
+    finite: np.ndarray  # mask of the finite limits
+    shape: tuple  # shape of the limits
+
+
+def _panel_layout(x, x0=0.0, order: int = GL_ORDER, max_width: float = GL_PANEL_WIDTH, fixed_grid: bool = False):
+    """
+    Returns the Gauss-Legendre panels integrating from `x0` to every value in `x`. The
+    finite values of `x` are sorted and de-duplicated, and the gaps between consecutive
+    points are split into panels no wider than `max_width`; with `fixed_grid`, the panels
+    are instead those of `_fixed_grid_integral`. The layout only depends on the limits, so
+    it can be reused by `_integrate_panels` or `_integrate_grid` for any integrand, and the
+    layouts of grids up to LAYOUT_CACHE_MAX_POINTS limits are cached; their arrays are read-only.
+    """
+    x = np.asarray(x, dtype=float)
+    if x.size > LAYOUT_CACHE_MAX_POINTS:
+        return (_build_grid_layout if fixed_grid else _build_panel_layout)(x, x0, order, max_width)
+    return _cached_panel_layout(x.tobytes(), x.shape, float(x0), order, float(max_width), fixed_grid)
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def _cached_panel_layout(data: bytes, shape: tuple, x0: float, order: int, max_width: float, fixed_grid: bool):
+    build = _build_grid_layout if fixed_grid else _build_panel_layout
+    layout = build(np.frombuffer(data).reshape(shape), x0, order, max_width)
+    for value in layout:
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+    return layout
+
+
+def _build_panel_layout(x, x0, order, max_width):
+    finite = np.isfinite(x)
+    xu, inverse = np.unique(np.append(x[finite], x0), return_inverse=True)
+    gaps = np.diff(xu)
+    nsub = np.maximum(np.ceil(gaps / max_width).astype(int), 1)
+    first_panel = np.cumsum(nsub) - nsub
+    widths = np.repeat(gaps / nsub, nsub)
+    starts = np.repeat(xu[:-1], nsub) + (np.arange(nsub.sum()) - np.repeat(first_panel, nsub)) * widths
+    nodes, weights = _gauss_legendre(order)
+    return _PanelLayout(starts[:, None] + widths[:, None] * nodes, widths, weights,
+                        np.append(first_panel, nsub.sum()), inverse.ravel(), finite, x.shape)
+
+
+def _integrate_panels(integrand, layout: _PanelLayout):
+    """
+    Integrates `integrand` over the panels of `layout`. All integrand evaluations happen
+    in one vectorized call, and the running sum over the panels gives the integral at each point.
+    """
+    if instrumentation.enabled:
+        instrumentation.count_integration()
+    values = integrand(layout.nodes)
+    panels = (values @ layout.weights) * layout.widths
+    cumulative = np.concatenate((np.zeros(panels.shape[:-1] + (1,)), np.cumsum(panels, axis=-1)), axis=-1)
+    at_points = cumulative[..., layout.ends]
+    at_points = at_points - at_points[..., [layout.inverse[-1]]]
+    result = np.full(panels.shape[:-1] + layout.shape, np.nan)
+    result[..., layout.finite] = at_points[..., layout.inverse[:-1]]
+    return result
+
+
+def _cumulative_integral(integrand, x, x0=0.0, order: int = GL_ORDER, max_width: float = GL_PANEL_WIDTH):
+    """
+    Integrates `integrand` from `x0` to every value in `x` in a single cumulative pass.
+
+    The finite values of `x` are sorted and de-duplicated, the gaps between consecutive
+    points are split into panels no wider than `max_width`, and every panel is integrated
+    with a fixed-order Gauss-Legendre rule. All integrand evaluations happen in one
+    vectorized call, and the running sum over the panels gives the integral at each point.
+
+    Args:
+        integrand (callable): Function of a numpy array of nodes. It may return extra
+            leading axes (e.g. several integrands stacked), the last axes must match its input.
+        x (float or np.ndarray): Upper integration limits.
+        x0 (float): Lower integration limit shared by all points.
+        order (int): Number of Gauss-Legendre nodes per panel.
+        max_width (float): Maximum panel width.
+
+    Returns:
+        np.ndarray: The integrals, with the integrand's leading axes followed by the shape of `x`.
+            Non-finite entries of `x` give nan.
+    """
+    return _integrate_panels(integrand, _panel_layout(x, x0, order, max_width))
+
+
+class _GridLayout(NamedTuple):
+    # a fixed grid of equal Gauss-Legendre panels covering the integration limits, see _fixed_grid_integral
+    nodes: np.ndarray  # (panels + near, order) integration nodes, those of the near limits last
+    width: float  # panel width
+    weights: np.ndarray  # (order,) weights on the unit interval
+    origin: int  # panel count below x0
+    panel: np.ndarray  # index of the panel of every finite limit
+    partial: np.ndarray  # (limits, 1 + order) weights of the integral up to the panel, which is 1, and
+                         # of the nodes of the panel's interpolant, integrated up to every finite limit
+    near: np.ndarray  # index of the finite limits other than x0 within a panel width of it, integrated directly
+    near_widths: np.ndarray  # their distances from x0
+    finite: np.ndarray  # mask of the finite limits
+    shape: tuple  # shape of the limits
+
+
+def _build_grid_layout(x, x0, order, width):
+    finite = np.isfinite(x)
+    points = x[finite]
+    first = int(np.floor((min(points.min(initial=x0), x0) - x0)/width))
+    last = max(int(np.ceil((max(points.max(initial=x0), x0) - x0)/width)), first + 1)
+    starts = x0 + width*np.arange(first, last)
+    panel = np.clip(np.floor((points - x0)/width).astype(int) - first, 0, len(starts) - 1)
+    partial = np.vander((points - starts[panel])/width, order + 1, increasing=True) @ _partial_gauss_legendre(order)
+    partial = np.concatenate((np.ones((len(points), 1)), width*partial), axis=1)
+    near = np.flatnonzero((np.abs(points - x0) < width) & (points != x0))
+    near_widths = points[near] - x0
+    nodes, weights = _gauss_legendre(order)
+    nodes = np.concatenate((starts[:, None] + width*nodes, x0 + near_widths[:, None]*nodes))
+    return _GridLayout(nodes, width, weights, -first, panel, partial, near, near_widths, finite, x.shape)
+
+
+def _integrate_grid(integrand, layout: _GridLayout):
+    """
+    Integrates `integrand` over the fixed grid of `layout`, see `_fixed_grid_integral`.
+    """
+    if instrumentation.enabled:
+        instrumentation.count_integration()
+    values = integrand(layout.nodes)
+    grid = len(layout.nodes) - len(layout.near)
+    values, near_values = values[..., :grid, :], values[..., grid:, :]
+    panels = (values @ layout.weights)*layout.width
+    below = np.cumsum(panels, axis=-1) - panels  # integral from the grid's start up to each panel
+    # one gather of every point's panel, with the integral up to it in front of its node values
+    stacked = np.concatenate((below[..., None], values), axis=-1)
+    at_points = np.einsum('...ij,ij->...i', np.take(stacked, layout.panel, axis=-2), layout.partial)
+    if layout.origin:
+        at_points -= panels[..., :layout.origin].sum(axis=-1, keepdims=True)
+    if len(layout.near):
+        # close to x0 the integrals are small and the interpolant's error would dominate them
+        at_points[..., layout.near] = (near_values @ layout.weights)*layout.near_widths
+    if len(layout.panel) == layout.finite.size:
+        return at_points.reshape(at_points.shape[:-1] + layout.shape)
+    result = np.full(at_points.shape[:-1] + layout.shape, np.nan)
+    result[..., layout.finite] = at_points
+    return result
+
+
+def _fixed_grid_integral(integrand, x, x0=0.0, order: int = GL_ORDER, width: float = GL_PANEL_WIDTH):
+    """
+    Integrates `integrand` from `x0` to every value in `x` over a fixed grid of panels.
+
+    Unlike in `_cumulative_integral`, the panels do not end at the points: they are `width`
+    wide, start from x0 and cover the range of the points, and each is integrated with a
+    fixed-order Gauss-Legendre rule. From the panel boundary below a point up to the point,
+    the polynomial interpolating the integrand at the panel's nodes is integrated, so the
+    integrand is only evaluated on the grid, however many points there are and however
+    closely they are spaced. Only points within one panel width of x0, whose integrals are
+    too small for the interpolant's error, get a Gauss-Legendre panel of their own.
+
+    Args:
+        integrand (callable): Function of a numpy array of nodes. It may return extra
+            leading axes (e.g. several integrands stacked), the last axes must match its input.
+        x (float or np.ndarray): Upper integration limits.
+        x0 (float): Lower integration limit shared by all points.
+        order (int): Number of Gauss-Legendre nodes per panel.
+        width (float): Panel width.
+
+    Returns:
+        np.ndarray: The integrals, with the integrand's leading axes followed by the shape of `x`.
+            Non-finite entries of `x` give nan.
+    """
+    return _integrate_grid(integrand, _panel_layout(x, x0, order, width, fixed_grid=True))
+
+
+def _as_output(value, z):
+    """
+    Returns a python float for scalar redshifts and the array otherwise.
+    """
+    return float(value) if np.ndim(z) == 0 else value
+
+
+def _flat_lambda_cdm_integrals(x, omega_M, omega_Lambda):
+    """
+    Line-of-sight, lookback and age integrals of a flat universe of matter and a
+    cosmological constant, including Einstein-de Sitter for omega_Lambda = 0 and a
+    negative cosmological constant, where asinh becomes arcsin.
+    """
+    from scipy.special import hyp2f1
+    q = omega_Lambda/omega_M
+    u = np.exp(x)
+    los = 2/np.sqrt(omega_M)*(hyp2f1(1/6, 1/2, 7/6, -q) - hyp2f1(1/6, 1/2, 7/6, -q/u**3)/np.sqrt(u))
+    # the age is 2/(3 sqrt(omega_Lambda)) asinh(b) with b = sqrt(q) u^(-3/2), written with
+    # asinh(b)/b so that it stays finite for omega_Lambda = 0; the lookback time uses
+    # asinh(a) - asinh(b) = asinh((a^2 - b^2)/(a sqrt(1+b^2) + b sqrt(1+a^2))) to avoid cancellation.
+    # For q < 0 the same holds with arcsin and 1 - b^2, 1 - a^2
+    sign, inverse = (1, np.arcsinh) if q >= 0 else (-1, np.arcsin)
+    a, b = np.sqrt(abs(q)), np.sqrt(abs(q))/u**1.5
+    s = np.sqrt(1 + sign*b**2) + np.sqrt(1 + sign*a**2)/u**1.5
+    d = a*-np.expm1(-3*x)/s
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lookback = 2/(3*np.sqrt(omega_M))*np.where(d > 0, inverse(d)/d, 1)*-np.expm1(-3*x)/s
+        age = 2/(3*np.sqrt(omega_M))/u**1.5*np.where(b > 0, inverse(b)/b, 1)
+    return np.stack((los, lookback, age))
+
+
+def _empty_integrals(x, omega_M, omega_Lambda):
+    """
+    Line-of-sight, lookback and age integrals of the empty (Milne) universe, E(z) = 1+z.
+    """
+    return np.stack((x, -np.expm1(-x), np.exp(-x)))
+
+
+def _de_sitter_integrals(x, omega_M, omega_Lambda):
+    """
+    Line-of-sight, lookback and age integrals of the flat de Sitter universe, E(z) = 1.
+    It has no beginning, so its age is infinite.
+    """
+    return np.stack((np.expm1(x), x, np.full(np.shape(x), np.inf)))
+
+
+closed_forms = {
+    'flat_lambda_cdm': _flat_lambda_cdm_integrals,
+    'empty': _empty_integrals,
+    'de_sitter': _de_sitter_integrals,
+}
+
+
+def _closed_form_regime(w, wa, omega_rad, omega_M, omega_Lambda, omega_k):
+    """
+    Returns the key in `closed_forms` of the special cosmology described by the
+    parameters, or None if the integrals have to be done numerically.
+    """
+    def vanishes(value):
+        return abs(value) <= CLOSED_FORM_TOLERANCE
+    if not vanishes(omega_rad):
+        return None
+    if vanishes(omega_M) and vanishes(omega_Lambda):
+        return 'empty'
+    if w != -1 or wa != 0 or not vanishes(omega_k):
+        return None
+    if omega_M > 0:
+        return 'flat_lambda_cdm'
+    if vanishes(omega_M):
+        return 'de_sitter'
+    return None
+
+
+def _small_curvature_volume(r, y):
+    """
+    Comoving volume in Gpc^3 within comoving distance r of a curved universe, for small
+    y = omega_k (r/DH)^2 where the closed forms cancel; series in y about the flat volume.
+    """
+    return 4/3*np.pi*r*r*r*(1 + y*(-3/10 + y*(9/56 - 5/48*y)))/(1.e9)
+
+
+def _transverse_curvature_derivative(omega_k, chi):
+    """
+    Derivative with respect to omega_k of the dimensionless transverse distance
+    sinh(sqrt(omega_k) chi)/sqrt(omega_k), or its flat and closed counterparts.
+    """
+    y = omega_k*chi**2
+    series = chi**3/6*(1 + y/10 + y**2/280)
+    if abs(omega_k) <= 1.e-15:
+        return series
+    root = np.sqrt(abs(omega_k))
+    if omega_k < 0:
+        exact = (chi*np.cos(root*chi) - np.sin(root*chi)/root)/(2*omega_k)
+    else:
+        exact = (chi*np.cosh(root*chi) - np.sinh(root*chi)/root)/(2*omega_k)
+    return np.where(np.abs(y) < VOLUME_SERIES_LIMIT, series, exact)
+
+
+class DarkEnergy:
+    """
+    Dark energy with an arbitrary equation of state w(z), given as a function or a table.
+
+    Its density relative to today, exp(3 int_0^x (1 + w) dx) with x = ln(1+z), is integrated
+    once when the model is created and kept as a cubic Hermite interpolant in x whose slopes,
+    3(1 + w), are exact at the nodes. Every evaluation is then a table lookup, so distances,
+    volumes and ages cost about as much as with the CPL form. Below z = 0 and beyond the last
+    node w is held constant, and the density continues as a power of 1+z.
+
+    Tabulated values are interpolated linearly in z and held constant outside the table.
+    Their redshifts are nodes of the interpolant, so the kinks of w cost no accuracy.
+
+    Args:
+        w (callable or tuple): A function of a redshift array returning w(z), or a pair of
+            arrays (z, w) with increasing, non-negative redshifts.
+        z_max (float): Redshift up to which the density is integrated.
+        nodes (int): Number of interpolation nodes evenly spaced in ln(1+z).
+
+    Attributes:
+        key: hashable identity of the model and its z_max and nodes, part of the cache keys
+            of the calculators using it
+        persistent: whether the key identifies the model in other processes too; this holds
+            for tables, while results of functions of z are never stored in the disk cache
+    """
+
+    def __init__(self, w, z_max: float = DARK_ENERGY_Z_MAX, nodes: int = DARK_ENERGY_NODES):
+        from scipy.interpolate import CubicHermiteSpline
+        if callable(w):
+            self._function, self._table = w, None
+            self.key = ('function', w, float(z_max), int(nodes))
+            self.persistent = False
+            x_nodes = np.linspace(0.0, np.log1p(z_max), nodes)
+        else:
+            z_table, w_table = (np.asarray(values, dtype=float) for values in w)
+            if z_table.ndim != 1 or z_table.shape != w_table.shape or not z_table.size:
+                raise ValueError('A tabulated w needs two one-dimensional arrays (z, w) of equal length')
+            if z_table[0] < 0 or np.any(np.diff(z_table) <= 0):
+                raise ValueError('The redshifts of a tabulated w must be increasing and non-negative')
+            self._function, self._table = None, (z_table, w_table)
+            self.key = ('table', hashlib.blake2b(z_table.tobytes() + w_table.tobytes(), digest_size=16).hexdigest(),
+                        float(z_max), int(nodes))
+            self.persistent = True
+            x_nodes = np.union1d(np.linspace(0.0, np.log1p(max(z_max, z_table[-1])), nodes), np.log1p(z_table))
+        self._x_max = x_nodes[-1]
+        self._z_max = np.expm1(self._x_max)
+        slopes = 3*(1 + self.w(np.expm1(x_nodes)))
+        if not np.all(np.isfinite(slopes)):
+            raise ValueError(f'w(z) must be finite for 0 <= z <= {self._z_max:g}')
+        log_density = _cumulative_integral(lambda x: 3*(1 + self.w(np.expm1(x))), x_nodes)
+        self._spline = CubicHermiteSpline(x_nodes, log_density, slopes)
+        self._slope_below, self._slope_above = slopes[0], slopes[-1]
+
+    def w(self, z):
+        """
+        Returns the equation of state at the redshift(s) z.
+        """
+        z = np.clip(np.asarray(z, dtype=float), 0.0, self._z_max)
+        if self._table is not None:
+            return np.interp(z, *self._table)
+        return np.broadcast_to(self._function(z), z.shape).astype(float)
+
+    def log_density(self, x):
+        """
+        Returns the logarithm of the density relative to today at x = ln(1+z).
+        """
+        x = np.asarray(x, dtype=float)
+        return (self._spline(np.clip(x, 0.0, self._x_max))
+                + self._slope_below*np.minimum(x, 0.0) + self._slope_above*np.maximum(x - self._x_max, 0.0))
+
+    def density(self, z):
+        """
+        Returns the density relative to today at the redshift(s) z.
+        """
+        return np.exp(self.log_density(np.log1p(z)))
+
+
+class CosmoParams(NamedTuple):
+    """
+    Immutable, hashable set of cosmological input parameters, in the order of
+    `cosmo_input_params`. It identifies a cosmology in the shared result cache.
+    """
+    H0: float
+    w: float
+    wa: float
+    omega_rad: float
+    omega_M: float
+    omega_Lambda: float
+
+
+def _nbytes(value, seen=None):
+    """
+    Returns the memory held by the numpy arrays in a value, found through dicts, lists,
+    tuples and the attributes of objects such as interpolants. Shared arrays count once.
+    """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_nbytes(v, seen) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v, seen) for v in value)
+    if isinstance(value, (type, types.FunctionType, types.MethodType, types.ModuleType)):
+        return 0
+    names = set(getattr(value, '__dict__', ()))
+    for cls in type(value).__mro__:
+        slots = getattr(cls, '__slots__', ())
+        names.update((slots,) if isinstance(slots, str) else slots)
+    return sum(_nbytes(getattr(value, name, None), seen) for name in names if not name.startswith('__'))
+
+
+class LRUCache:
+    """
+    A bounded, thread-safe least-recently-used cache.
+
+    Concurrent requests for a key that is being computed wait for the first computation
+    instead of repeating it, so many sessions asking for the same cosmology at once
+    cost a single computation.
+
+    Attributes:
+        maxsize: maximum number of entries kept
+        max_bytes: maximum memory of the numpy arrays held by the entries, or None for no
+            limit; a value larger than this on its own is returned without being kept
+        nbytes: memory of the numpy arrays currently held
+        hits: number of lookups answered from the cache
+        misses: number of lookups that had to compute their value
+    """
+
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, max_bytes: int = None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value for `key`, calling `compute()` to create it on a miss.
+
+        Args:
+            key (hashable): The cache key.
+            compute (callable): Function without arguments returning the value.
+
+        Returns:
+            Any: The cached or freshly computed value.
+        """
+        while True:
+            with self._lock:
+                if key in self._data:
+                    self.hits += 1
+                    self._data.move_to_end(key)
+                    return self._data[key]
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.misses += 1
+                    self._pending[key] = threading.Event()
+                    break
+            # another thread is computing this entry; retry once it is done
+            pending.wait()
+        try:
+            value = compute()
+            size = _nbytes(value) if self.max_bytes is not None else 0
+            if self.max_bytes is not None and size > self.max_bytes:
+                return value
+            with self._lock:
+                self._data[key] = value
+                self._sizes[key] = size
+                self.nbytes += size
+                while len(self._data) > self.maxsize or self.max_bytes is not None and self.nbytes > self.max_bytes:
+                    evicted, _ = self._data.popitem(last=False)
+                    self.nbytes -= self._sizes.pop(evicted)
+            return value
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+    def clear(self):
+        """
+        Removes all entries and resets the statistics.
+        """
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+# process-wide cache of integrals, tables and evaluated arrays, shared by all instances
+result_cache = LRUCache(RESULT_CACHE_SIZE, RESULT_CACHE_MAX_BYTES)
+
+
+class DiskCache:
+    """
+    A persistent cache of precomputed arrays, shared by all processes using the same directory.
+
+    Every entry is a compressed .npz file named after a hash of its key, which includes
+    `__version__`. Besides the arrays, the file records the format version, the hash and a
+    checksum of the array data, so entries of other versions, truncated or corrupt files
+    are detected on load and rebuilt. Files are written to a temporary name and renamed,
+    so concurrent writers never expose a partial entry.
+
+    Loading an entry touches its modification time. After every write, the least recently
+    used entries are deleted until the directory holds at most `max_bytes` of entries.
+
+    Attributes:
+        directory: the cache directory, or None to switch the cache off
+        max_bytes: the size limit of all entries together
+        hits: number of entries loaded from disk
+        misses: number of entries that had to be computed
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = DISK_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, key):
+        return hashlib.blake2b(repr((__version__, key)).encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _checksum(arrays: dict):
+        digest = hashlib.blake2b(digest_size=16)
+        for name in sorted(arrays):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+        return digest.hexdigest()
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the arrays stored for `key`, calling `compute()` to create and store them
+        when the entry is missing, stale or corrupt, or the cache is switched off.
+
+        Args:
+            key: A key whose repr identifies the entry, or None for an entry that is not stored.
+            compute (callable): Function without arguments returning a dict of arrays.
+
+        Returns:
+            dict: The arrays by name.
+        """
+        if self.directory is None or key is None:
+            return compute()
+        digest = self._digest(key)
+        path = os.path.join(self.directory, f'{digest}.npz')
+        arrays = self._load(path, digest)
+        if arrays is not None:
+            self.hits += 1
+            self._touch(path)
+            return arrays
+        arrays = {name: np.asarray(value) for name, value in compute().items()}
+        self.misses += 1
+        self._save(path, digest, arrays)
+        self._evict()
+        return arrays
+
+    def _load(self, path, digest):
+        import zipfile
+        try:
+            with np.load(path, allow_pickle=False) as file:
+                if int(file['format']) != DISK_CACHE_FORMAT or str(file['key']) != digest:
+                    return None
+                arrays = {name[len('array_'):]: file[name] for name in file.files if name.startswith('array_')}
+                if str(file['checksum']) != self._checksum(arrays):
+                    return None
+                return arrays
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return None
+
+    def _save(self, path, digest, arrays):
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temporary, 'wb') as file:
+                np.savez_compressed(file, format=DISK_CACHE_FORMAT, key=digest, checksum=self._checksum(arrays),
+                                    **{f'array_{name}': value for name, value in arrays.items()})
+            os.replace(temporary, path)
+        except OSError:
+            # an unwritable cache only costs the persistence, the results are still returned
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # e.g. a read-only cache, which then evicts by write time
+
+    def _evict(self):
+        # deletes the entries used longest ago until the rest fit into max_bytes
+        entries = []
+        try:
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.endswith('.npz'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # already evicted by another process
+            total -= size
+
+    def clear(self):
+        """
+        Deletes all entries in the directory and resets the statistics.
+        """
+        if self.directory is not None and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.npz'):
+                    os.remove(os.path.join(self.directory, name))
+        self.hits = 0
+        self.misses = 0
+
+
+# process-wide persistent cache of tables, switched on by setting its directory
+disk_cache = DiskCache(DISK_CACHE_DIR)
+
+
+class Instrumentation:
+    """
+    Opt-in, process-wide counters and timers.
+
+    While enabled, it counts the integrand evaluations (the number of redshifts passed to
+    `_E`, `_freidman` and `_tage_int`) and the quadrature passes, attributing them to the
+    outermost public `Cosmocalc` method being called, and records the calls and wall time
+    of every timed method or stage. Disabled, it costs one attribute check per call.
+
+    Attributes:
+        enabled: whether anything is recorded
+        caches: objects with `hits` and `misses` attributes whose hit rates are reported, by name
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.caches = {'result_cache': result_cache, 'disk_cache': disk_cache}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """
+        Clears all counters and timers. The statistics of the caches are kept.
+        """
+        with self._lock:
+            self._evaluations = defaultdict(Counter)
+            self._integrations = Counter()
+            self._timings = defaultdict(lambda: [0, 0.0])
+
+    def _method(self):
+        stack = getattr(self._local, 'stack', None)
+        return stack[0] if stack else None
+
+    def count_evaluations(self, function: str, n: int):
+        with self._lock:
+            self._evaluations[self._method()][function] += n
+
+    def count_integration(self):
+        with self._lock:
+            self._integrations[self._method()] += 1
+
+    @contextmanager
+    def timer(self, name: str, method: bool = False):
+        """
+        Times the enclosed block under `name`. With method=True, the evaluations and
+        integrations inside the block are attributed to `name` unless an enclosing
+        method already claims them.
+        """
+        if not self.enabled:
+            yield
+            return
+        stack = self._local.__dict__.setdefault('stack', [])
+        if method:
+            stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if method:
+                stack.pop()
+            with self._lock:
+                self._timings[name][0] += 1
+                self._timings[name][1] += elapsed
+
+    def timed(self, name: str = None, method: bool = False):
+        """
+        Decorator timing every call of a function, see `timer`.
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.timer(name or func.__name__, method):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self):
+        """
+        Returns the statistics as a dict of plain python types: per timed name the number
+        of calls and total seconds, per method the integrand evaluations by function and
+        the quadrature passes, and per cache its hits, misses and hit rate. Work done
+        outside any public method is reported under '-'.
+        """
+        with self._lock:
+            return {
+                'timings': {name: {'calls': calls, 'seconds': seconds}
+                            for name, (calls, seconds) in self._timings.items()},
+                'evaluations': {method or '-': dict(counts) for method, counts in self._evaluations.items()},
+                'integrations': {method or '-': n for method, n in self._integrations.items()},
+                'caches': {name: {'hits': cache.hits, 'misses': cache.misses,
+                                  'hit_rate': cache.hits/(cache.hits + cache.misses) if cache.hits + cache.misses else None}
+                           for name, cache in self.caches.items()},
+            }
+
+
+instrumentation = Instrumentation()
+
+
+def _instrumented(func):
+    # times a public Cosmocalc method and attributes the work done inside it
+    return instrumentation.timed(f'Cosmocalc.{func.__name__}', method=True)(func)
+
+
+def _read_only(value):
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    return value
+
+
+def _array_key(z: np.ndarray):
+    """
+    Returns a hashable digest identifying the contents of the array z.
+    """
+    return z.shape, hashlib.blake2b(np.ascontiguousarray(z).tobytes(), digest_size=16).hexdigest()
+
 
 
 class Cosmocalc:
@@ -25,6 +899,15 @@ class Cosmocalc:
         omega_Lambda: dark energy density parameter
         z: redshift
         DH: the comoving distance to the horizon at the present epoch
+        params: the input parameters as a hashable CosmoParams, used as the shared cache key
+        closed_form: the key in closed_forms of the special cosmology whose analytic integrals
+            are used, or None when the integrals are done numerically
+        force_numerical: if True, the closed forms are never used, e.g. to verify them
+        accuracy: the accuracy profile, a key of ACCURACY_PROFILES ('display', 'standard' or
+            'precision'), setting the quadrature order and resolution and the table error target
+        dark_energy: a DarkEnergy with an arbitrary equation of state w(z), which replaces the
+            CPL form of w and wa, or None; a function of z or a pair of arrays (z, w) may be
+            assigned and is wrapped in a DarkEnergy
 
     Methods:
         _E(z):
@@ -38,91 +921,182 @@ class Cosmocalc:
         comoving_distance(z):
             Calculates the comoving distance to a redshift z.
             Parameters:
-                z : float
-                    Redshift.
+                z : float or np.ndarray
+                    Redshift(s).
             Returns:
-                float : The comoving distance in Mpc.
+                float or np.ndarray : The comoving distance in Mpc. Arrays of redshifts are
+                    integrated in a single cumulative pass over the sorted, unique values.
 
         luminosity_distance(z):
             Calculates the luminosity distance to a redshift z.
             Parameters:
-                z : float
-                    Redshift.
+                z : float or np.ndarray
+                    Redshift(s).
             Returns:
-                float : The luminosity distance in Mpc.
+                float or np.ndarray : The luminosity distance in Mpc.
 
         angular_diameter_distance(z):
             Calculates the angular diameter distance to a redshift z.
             Parameters:
-                z : float
-                    Redshift.
+                z : float or np.ndarray
+                    Redshift(s).
+            Returns:
+                float or np.ndarray : The angular diameter distance in Mpc.
+
+        angular_diameter_distance_z1z2(z1, z2):
+            Calculates the angular diameter distance between two redshifts, e.g. from a
+            lens at z1 to a source at z2, from one interpolation table per cosmology.
+            Parameters:
+                z1, z2 : float or np.ndarray
+                    Redshift(s), broadcast against each other.
+            Returns:
+                float or np.ndarray : The angular diameter distance in Mpc.
+
+        critical_surface_density(z_lens, z_source):
+            Calculates the critical surface density for lensing.
             Returns:
-                float : The angular diameter distance in Mpc.
+                float or np.ndarray : The critical surface density in solar masses per pc^2.
 
         comoving_volume_element(z):
             Calculates the comoving volume element at a redshift z.
             Parameters:
-                z : float
-                    Redshift.
+                z : float or np.ndarray
+                    Redshift(s).
             Returns:
-                float : The comoving volume element in Gpc^3.
+                float or np.ndarray : The comoving volume element in Gpc^3.
 
         comoving_volume(z):
             Calculates the comoving volume out to a redshift z.
             Parameters:
-                z : float
-                    Redshift.
+                z : float or np.ndarray
+                    Redshift(s).
             Returns:
-                float : The comoving volume in Gpc^3.
+                float or np.ndarray : The comoving volume in Gpc^3.
 
         distance_modulus(z):
             Calculates the distance modulus to a redshift z.
             Parameters:
-                z : float
-                    Redshift.
-            Returns:
-                float : The distance modulus.
-
-        _calculate_age_universe(t_i, t_f):
-            Calculates the age of the universe between t_i and t_f.
-            Parameters:
-                t_i : float
-                    Initial time in Gyr.
-                t_f : float
-                    Final time in Gyr.
+                z : float or np.ndarray
+                    Redshift(s).
             Returns:
-                float : The age of the universe in Gyr.
+                float or np.ndarray : The distance modulus.
 
         light_travel_time(z):
             Calculates the light travel time to a redshift z.
             Parameters:
-                z : float
-                    Redshift.
+                z : float or np.ndarray
+                    Redshift(s).
             Returns:
-                float : The light travel time in Gyr.
+                float or np.ndarray : The light travel time in Gyr.
 
         age_at_z(z):
             Calculates the age of the universe at a redshift z.
             Parameters:
-                z : float
-                    Redshift.
+                z : float or np.ndarray
+                    Redshift(s).
             Returns:
-                float : The age of the universe in Gyr at redshift z.
+                float or np.ndarray : The age of the universe in Gyr at redshift z.
 
         age_today():
             Calculates the age of the universe today.
             Returns:
                 float : The age of the universe in Gyr.
+
+        evaluate(z, quantities=None):
+            Calculates several of the quantities above at once, computing the line-of-sight
+            integral and the age integral only once per redshift.
+            Parameters:
+                z : float or np.ndarray
+                    Redshift(s).
+                quantities : list, optional
+                    Names of the quantities, taken from result_quantities. Defaults to all.
+            Returns:
+                dict : The value of each requested quantity keyed by its name.
+
+        jacobian(z, quantities=None):
+            Calculates distances and ages together with their derivatives with respect to
+            the six input parameters, integrated alongside the values in one pass.
+            Parameters:
+                z : float or np.ndarray
+                    Redshift(s).
+                quantities : list, optional
+                    Names of the quantities, taken from jacobian_quantities. Defaults to all.
+            Returns:
+                tuple : A dict of the values and a dict of the derivatives, each of shape
+                    (6,) + shape of z with rows ordered as cosmo_input_params.
+
+        from_params(params):
+            Creates a calculator from a CosmoParams. The dark energy model is not part of it.
+
+        set_params(**params):
+            Updates several parameters at once, validating them and recomputing the derived
+            state only once, and only if a value changed.
+            Returns:
+                bool : Whether any value changed.
+
+        enable_tables(z_max=1100.0, rtol=None):
+            Switches on the table mode: the distance and age integrals are tabulated in
+            ln(1+z) on first use and looked up afterwards. Changing a parameter discards the table.
+            Parameters:
+                z_max : float
+                    Maximum redshift covered by the table.
+                rtol : float
+                    Target relative error of the table, by default that of the accuracy profile.
+
+        disable_tables():
+            Switches off the table mode.
+
+        sample_redshifts(z_min, z_max, quantities=None, max_points=100, rtol=1e-3):
+            Chooses redshifts adapted to the shape of the quantities, dense where they bend
+            against log z and sparse where they are nearly linear.
+            Returns:
+                tuple : The redshifts and a dict of the values of every quantity there.
+
+        growth_factor(z):
+            Calculates the linear growth factor D(z), normalized to 1 today, from one
+            integration of the growth equation per parameter set.
+
+        growth_rate(z):
+            Calculates the linear growth rate f(z) = dlnD/dlna.
+
+        draw_redshifts(n, z_min, z_max, weight=None, seed=None):
+            Draws n redshifts distributed as the comoving volume element, optionally times
+            a weight function of z, by inverse-CDF sampling from a cached table.
+            Returns:
+                np.ndarray : The redshifts.
+
+        bin_volumes(z_edges, sky_area=41252.96):
+            Calculates the comoving volumes in Gpc^3 of the redshift bins between z_edges,
+            for a sky area in square degrees.
+
+        z_at(quantity, values, z_max=1100.0):
+            Calculates the redshifts at which a quantity takes the given values.
+            Parameters:
+                quantity : str
+                    One of invertible_quantities.
+                values : float or np.ndarray
+                    Target values.
+            Returns:
+                float or np.ndarray : The redshifts, nan for targets out of range.
     """
 
-    def __init__(self, H0: float, w: float, wa: float, omega_rad: float, omega_M: float, omega_Lambda: float):
+    def __init__(self, H0: float, w: float, wa: float, omega_rad: float, omega_M: float, omega_Lambda: float,
+                 force_numerical: bool = False, accuracy: str = DEFAULT_ACCURACY, dark_energy=None):
+        self._force_numerical = force_numerical
+        self._check_accuracy(accuracy)
+        self._accuracy = accuracy
+        self._dark_energy = self._as_dark_energy(dark_energy)
         self._H0 = H0
         self._w = w
         self._wa = wa
         self._omega_rad = omega_rad
         self._omega_M = omega_M
         self._omega_Lambda = omega_Lambda
+        self._check_params({'H0': H0, 'w': w, 'wa': wa, 'omega_rad': omega_rad,
+                            'omega_M': omega_M, 'omega_Lambda': omega_Lambda})
         self._DH = c/H0
+        self._table_settings = None
+        self._table = None
         #self._omega_k = 1 - omega_M - omega_Lambda - omega_rad  # curvature
         self._update_cosmo_params()
 
@@ -139,8 +1113,53 @@ class Cosmocalc:
             'omega_k': self.omega_k,
             # 'z': self.z
         }
-    
-                 
+        # python floats, so that ints, floats and numpy scalars of equal value share cache entries
+        self._params = CosmoParams(*(float(getattr(self, p)) for p in cosmo_input_params))
+        self._closed_form = None if self.force_numerical else _closed_form_regime(
+            self.w, self.wa, self.omega_rad, self.omega_M, self.omega_Lambda, self.omega_k)
+        if self.dark_energy is not None and self._closed_form != 'empty':
+            # only the empty universe has no dark energy to depend on
+            self._closed_form = None
+        self._table = None  # tables depend on every parameter
+
+    @staticmethod
+    def _check_params(params: dict):
+        unknown = [name for name in params if name not in cosmo_input_params]
+        if unknown:
+            raise ValueError(f'Unknown parameters {unknown}, choose from {cosmo_input_params}')
+        for name, value in params.items():
+            try:
+                finite = np.isfinite(float(value))
+            except (TypeError, ValueError):
+                finite = False
+            if not finite:
+                raise ValueError(f'{name} must be a finite number, got {value!r}')
+        if 'H0' in params and not params['H0'] > 0:
+            raise ValueError(f'H0 must be positive, got {params["H0"]!r}')
+
+    def set_params(self, **params):
+        """
+        Updates several parameters at once. They are validated together, and the derived
+        state (omega_k, DH, the closed-form regime, the table) is recomputed once.
+
+        Args:
+            **params: New values keyed by names from `cosmo_input_params`.
+
+        Returns:
+            bool: Whether any value changed. Only then is the derived state recomputed.
+
+        Raises:
+            ValueError: If a name is unknown, a value is not a finite number or H0 is not positive.
+        """
+        self._check_params(params)
+        changed = {name: value for name, value in params.items() if value != getattr(self, name)}
+        if not changed:
+            return False
+        for name, value in changed.items():
+            setattr(self, f'_{name}', value)
+        self._DH = c/self.H0
+        self._update_cosmo_params()
+        return True
 
     @property
     def H0(self):
@@ -148,9 +1167,7 @@ class Cosmocalc:
 
     @H0.setter
     def H0(self, value):
-        self._H0 = value
-        self._DH = c/value
-        self._update_cosmo_params()
+        self.set_params(H0=value)
 
     @property
     def w(self):
@@ -158,8 +1175,7 @@ class Cosmocalc:
 
     @w.setter
     def w(self, value):
-        self._w = value
-        self._update_cosmo_params()
+        self.set_params(w=value)
 
     @property
     def wa(self):
@@ -167,8 +1183,7 @@ class Cosmocalc:
 
     @wa.setter
     def wa(self, value):
-        self._wa = value
-        self._update_cosmo_params()
+        self.set_params(wa=value)
 
     @property
     def omega_rad(self):
@@ -176,8 +1191,7 @@ class Cosmocalc:
 
     @omega_rad.setter
     def omega_rad(self, value):
-        self._omega_rad = value
-        self._update_cosmo_params()
+        self.set_params(omega_rad=value)
 
     @property
     def omega_M(self):
@@ -185,8 +1199,7 @@ class Cosmocalc:
 
     @omega_M.setter
     def omega_M(self, value):
-        self._omega_M = value
-        self._update_cosmo_params()
+        self.set_params(omega_M=value)
 
     @property
     def omega_Lambda(self):
@@ -194,8 +1207,82 @@ class Cosmocalc:
 
     @omega_Lambda.setter
     def omega_Lambda(self, value):
-        self._omega_Lambda = value
-        self._update_cosmo_params()
+        self.set_params(omega_Lambda=value)
+
+    @property
+    def params(self):
+        return self._params
+
+    @property
+    def force_numerical(self):
+        return self._force_numerical
+
+    @force_numerical.setter
+    def force_numerical(self, value):
+        if value != self._force_numerical:
+            self._force_numerical = value
+            self._update_cosmo_params()
+
+    @property
+    def closed_form(self):
+        return self._closed_form
+
+    @property
+    def accuracy(self):
+        return self._accuracy
+
+    @accuracy.setter
+    def accuracy(self, value):
+        self._check_accuracy(value)
+        if value != self._accuracy:
+            self._accuracy = value
+            self._table = None
+
+    @property
+    def dark_energy(self):
+        return self._dark_energy
+
+    @dark_energy.setter
+    def dark_energy(self, value):
+        value = self._as_dark_energy(value)
+        if value is not self._dark_energy:
+            self._dark_energy = value
+            self._update_cosmo_params()
+
+    @staticmethod
+    def _as_dark_energy(value):
+        if value is None or isinstance(value, DarkEnergy):
+            return value
+        return DarkEnergy(value)
+
+    @staticmethod
+    def _check_accuracy(accuracy):
+        if accuracy not in ACCURACY_PROFILES:
+            raise ValueError(f'Unknown accuracy profile {accuracy}, choose one of {list(ACCURACY_PROFILES)}')
+
+    @property
+    def _profile(self):
+        return ACCURACY_PROFILES[self.accuracy]
+
+    def _quadrature(self, integrand, x, x0=0.0, age=False):
+        # cumulative integral with the order and panel width of the accuracy profile, in
+        # s = sqrt(a) with the age panel width if age is True
+        profile = self._profile
+        width = profile['age_panel_width' if age else 'panel_width']
+        if profile['fixed_grid']:
+            return _fixed_grid_integral(integrand, x, x0, profile['order'], width)
+        return _cumulative_integral(integrand, x, x0, profile['order'], width)
+
+    @property
+    def _cache_key(self):
+        # everything the shared results depend on, also the class as subclasses may integrate differently
+        if self.dark_energy is None:
+            return type(self).__qualname__, self.params, self.closed_form, self.accuracy
+        return type(self).__qualname__, self.params, self.closed_form, self.accuracy, self.dark_energy.key
+
+    @classmethod
+    def from_params(cls, params: CosmoParams):
+        return cls(*params)
 
     @property
     def omega_k(self):
@@ -207,40 +1294,321 @@ class Cosmocalc:
 
     
     def _E(self, z):
-        return np.sqrt(self.omega_M*(1+z)**3 + self.omega_k*(1+z)**2 + self.omega_rad*(1+z)**4
-                       + self.omega_Lambda*(1+z)**(3*(1+self.w+self.wa))*math.exp(-3*self.wa*(1-1/(1+z))))
+        if instrumentation.enabled:
+            instrumentation.count_evaluations('_E', np.size(z))
+        u = 1 + z
+        u2 = u*u
+        return np.sqrt(u2*(self.omega_M*u + self.omega_k + self.omega_rad*u2)
+                       + self.omega_Lambda*self._dark_energy_density(z))
+
+    def _dark_energy_density(self, z):
+        # dark energy density relative to today, of the CPL form unless a w(z) model is set
+        if self.dark_energy is not None:
+            return self.dark_energy.density(z)
+        if self.w == -1 and self.wa == 0:
+            return np.ones_like(z)
+        return (1+z)**(3*(1+self.w+self.wa))*np.exp(-3*self.wa*(1-1/(1+z)))
+
+    def _equation_of_state(self, z):
+        if self.dark_energy is not None:
+            return self.dark_energy.w(z)
+        return self.w + self.wa*z/(1+z)
 
     def _freidman(self, z):
+        if instrumentation.enabled:
+            instrumentation.count_evaluations('_freidman', np.size(z))
         return 1/self._E(z)
 
     def _tage_int(self, z):
+        if instrumentation.enabled:
+            instrumentation.count_evaluations('_tage_int', np.size(z))
         return 1/((1+z)*self._E(z))
 
-    def comoving_distance(self, z):
-        freidman_integral = float(quad(self._freidman, 0, z)[0])
+    def _freidman_gradient(self, z):
+        """
+        Returns 1/E(z) stacked on its derivatives with respect to each parameter in
+        `cosmo_input_params`, with omega_k = 1 - omega_M - omega_Lambda - omega_rad.
+        """
+        u = 1 + z
+        freidman = self._freidman(z)
+        dark_energy = self._dark_energy_density(z)
+        # derivatives of E^2, the curvature term takes up the change of every density;
+        # w and wa have no effect when a w(z) model replaces the CPL form
+        d_E2 = {
+            'omega_rad': u**4 - u**2,
+            'omega_M': u**3 - u**2,
+            'omega_Lambda': dark_energy - u**2,
+        }
+        if self.dark_energy is None:
+            d_E2['w'] = 3*self.omega_Lambda*dark_energy*np.log(u)
+            d_E2['wa'] = 3*self.omega_Lambda*dark_energy*(np.log(u) - 1 + 1/u)
+        return np.stack([freidman] + [-freidman**3/2*d_E2[p] if p in d_E2 else np.zeros_like(freidman)
+                                      for p in cosmo_input_params])
+
+    def _integrals(self, z, los=True, age=True):
+        """
+        Returns the line-of-sight integral of dz/E(z) from 0 to z, and the lookback and
+        age integrals of dz/((1+z)E(z)) from 0 to z and from z to infinity. When the table
+        mode is enabled they are looked up from the interpolation table instead.
+        """
+        if not (los or age):
+            return None, None, None
+        x = np.log1p(np.asarray(z, dtype=float))
+        if self._table_settings is not None:
+            return tuple(self._table_integrals(x))
+        integrals = list(self._direct_integrals(x, los, age))
+        los_integral = integrals.pop(0) if los else None
+        if not age:
+            return los_integral, None, None
+        return los_integral, integrals[0], integrals[1]
+
+    def _direct_integrals(self, x, los=True, age=True):
+        """
+        Returns the requested rows of (line-of-sight, lookback, age) integrals at x = ln(1+z),
+        from the closed forms when the cosmology has them and numerically otherwise.
+        """
+        if self.closed_form is None:
+            return self._numerical_integrals(x, los, age)
+        return self._closed_form_integrals(x, los, age)
+
+    def _numerical_integrals(self, x, los=True, age=True):
+        """
+        Integrates the requested rows of (line-of-sight, lookback, age) at x = ln(1+z).
+
+        The line-of-sight and lookback integrals are carried out in x, where dz = (1+z) dx,
+        and share the same integrand evaluations. The age integral is the integral of
+        da/(aE) from 0 to a = 1/(1+z), carried out in s = sqrt(a) where the integrand
+        2/(sE) is regular at s = 0, so it needs no improper integration. Below AGE_SPLIT_Z
+        the age is the age today minus the lookback integral, except for profiles with a
+        fixed grid, whose grid in s costs the same for any points and gives every age, and
+        the age today at s = 1, directly. Below CLOSED_FORM_MIN_Z of a closed form cosmology
+        the ages always start from the closed form's age today. The integrals to z = infinity
+        are taken from `_infinite_redshift_integrals`.
+        """
+        def integrand(x):
+            freidman = self._freidman(np.expm1(x))
+            stacked = []
+            if los:
+                stacked.append(np.exp(x)*freidman)
+            if age:
+                stacked.append(freidman)
+            return np.stack(stacked)
+        rows = self._quadrature(integrand, x)
+        infinite = np.isposinf(x)
+        if np.any(infinite):
+            rows[:, infinite] = self._infinite_redshift_integrals(los, age)[:, None]
+        if not age:
+            return rows
+        if self._profile['fixed_grid'] and self.closed_form is None:
+            ages = self._scale_factor_integral(np.append(np.exp(-x/2), 1.0))
+            result_cache.get_or_compute((self._cache_key, 'age_today'), lambda: float(ages[-1]))
+            return np.concatenate((rows, ages[:-1].reshape((1,) + np.shape(x))))
+        far = x > np.log1p(AGE_SPLIT_Z)
+        ages = np.array(self._age_today_integral() - rows[-1])
+        ages[far] = self._scale_factor_integral(np.exp(-x[far]/2))
+        return np.concatenate((rows, ages[None]))
+
+    def _infinite_redshift_integrals(self, los=True, age=True):
+        # the requested rows of (line-of-sight, lookback) integrals up to z = infinity, which
+        # x cannot reach: the line-of-sight integral is carried out in s = sqrt(a) like the
+        # age, where dz/E = 2 ds/(s^3 E), and the lookback integral is the age today
+        rows = []
+        if los:
+            rows.append(result_cache.get_or_compute((self._cache_key, 'los_infinity'), self._los_to_infinity))
+        if age:
+            rows.append(self._age_today_integral())
+        return np.array(rows)
+
+    def _los_to_infinity(self):
+        u = np.array(INFINITE_Z_PROBES)
+        with np.errstate(over='ignore'):
+            near, far = u*self._freidman(u - 1)
+        if not (far == 0 or far < near/2):
+            return np.inf
+        return float(self._quadrature(lambda s: 2/s**3*self._freidman(1/s**2 - 1), 1.0, age=True))
+
+    def _gradient_integrals(self, x):
+        """
+        Returns the line-of-sight, lookback and age integrals at x = ln(1+z), each stacked
+        on its derivatives with respect to `cosmo_input_params`. The derivatives are
+        integrated under the integral sign on the same nodes and in the same pass as the
+        values, split between the lookback and the scale factor integral as in
+        `_numerical_integrals`.
+        """
+        def integrand(x):
+            gradient = self._freidman_gradient(np.expm1(x))
+            return np.concatenate((np.exp(x)*gradient, gradient))
+        n = len(cosmo_input_params) + 1
+        rows = self._quadrature(integrand, x)
+        los, lookback = rows[:n], rows[n:]
+        far = x > np.log1p(AGE_SPLIT_Z)
+        ages = self._age_today_gradient()[(slice(None),) + (None,)*x.ndim] - lookback
+        ages[:, far] = self._scale_factor_gradient(np.exp(-x[far]/2))
+        return los, lookback, ages
+
+    def _scale_factor_gradient(self, s):
+        # the scale factor integral and its derivatives, see _scale_factor_integral
+        return self._quadrature(lambda s: 2/s*self._freidman_gradient(1/s**2 - 1), s, age=True)
+
+    def _age_today_gradient(self):
+        return result_cache.get_or_compute((self._cache_key, 'age_today_gradient'),
+                                           lambda: _read_only(self._scale_factor_gradient(1.0)))
+
+    def _closed_form_integrals(self, x, los=True, age=True):
+        if instrumentation.enabled:
+            instrumentation.count_evaluations('closed_form', np.size(x))
+        integrals = closed_forms[self.closed_form](x, self.omega_M, self.omega_Lambda)[[los, age, age]]
+        low = x < np.log1p(CLOSED_FORM_MIN_Z)
+        if np.any(low):
+            integrals[:, low] = self._numerical_integrals(x[low], los, age)
+        return integrals
+
+    def _scale_factor_integral(self, s):
+        # integral of 2/(sE) ds from 0 to s = sqrt(a)
+        return self._quadrature(lambda s: 2/s*self._freidman(1/s**2 - 1), s, age=True)
+
+    def enable_tables(self, z_max: float = TABLE_Z_MAX, rtol: float = None):
+        """
+        Switches on the table mode. On first use, the line-of-sight, lookback and age
+        integrals are tabulated as cubic splines in ln(1+z) up to z_max, refined until the
+        relative interpolation error is below rtol. Later calls are vectorized table lookups,
+        and redshifts outside [0, z_max] fall back to direct integration. Changing any
+        cosmological parameter discards the table. When the `disk_cache` is switched on,
+        the table nodes are stored there and loaded by later processes.
+
+        Args:
+            z_max (float): Maximum redshift covered by the table.
+            rtol (float, optional): Target relative error of the tabulated integrals.
+                Defaults to the table_rtol of the accuracy profile in use.
+        """
+        if rtol is None:
+            rtol = self._profile['table_rtol']
+        if z_max <= 0 or rtol <= 0:
+            raise ValueError('z_max and rtol must be positive')
+        self._table_settings = (float(z_max), float(rtol))
+        self._table = None
+
+    def disable_tables(self):
+        """
+        Switches off the table mode and discards the table.
+        """
+        self._table_settings = None
+        self._table = None
+
+    def _table_rows(self, x):
+        # the distance and lookback splines interpolate integral/x, which is 1 at x=0, so
+        # that the error target is relative all the way down to z=0; the age integral
+        # falls off exponentially in x and is tabulated as a logarithm
+        rows = self._direct_integrals(x)
+        rows[2] = np.log(rows[2])
+        rows[:2, 1:] /= x[1:]
+        rows[:2, 0] = 1
+        return rows
+
+    def _interpolation_table(self):
+        if self._table is None:
+            self._table = self._shared_table(*self._table_settings)
+        return self._table
+
+    def _shared_table(self, z_max, rtol):
+        return result_cache.get_or_compute((self._cache_key, 'table', z_max, rtol),
+                                           lambda: self._build_interpolation_table(z_max, rtol))
+
+    def _disk_key(self, *entry):
+        # identifies persistent entries; None keeps the entries of a w(z) function, which has
+        # no identity across processes, off disk
+        if self.dark_energy is not None and not self.dark_energy.persistent:
+            return None
+        return self._cache_key + entry
+
+    def _build_interpolation_table(self, z_max, rtol):
+        from scipy.interpolate import CubicSpline
+        nodes = disk_cache.get_or_compute(self._disk_key('table', z_max, rtol), lambda: self._tabulate(z_max, rtol))
+        return nodes['x'][-1], CubicSpline(nodes['x'], nodes['rows'], axis=1)
+
+    def _tabulate(self, z_max, rtol):
+        # table nodes in x = ln(1+z), doubled until the interpolation error is below rtol
+        from scipy.interpolate import CubicSpline
+        x_max = np.log1p(z_max)
+        n = TABLE_MIN_NODES
+        while True:
+            x = np.linspace(0, x_max, 2*n + 1)
+            rows = self._table_rows(x)
+            if not np.all(np.isfinite(rows)):
+                raise ValueError(f'The distance and age integrals are not finite up to z={z_max} '
+                                 'for this cosmology, so they cannot be tabulated')
+            table = CubicSpline(x[::2], rows[:, ::2], axis=1)
+            interpolated = table(x[1::2])
+            error = max(np.max(np.abs(interpolated[:2]/rows[:2, 1::2] - 1)),
+                        np.max(np.abs(np.expm1(interpolated[2] - rows[2, 1::2]))))
+            if not error > rtol or n >= TABLE_MAX_NODES:
+                break
+            n *= 2
+        return {'x': x, 'rows': rows}
+
+    def _table_integrals(self, x, table=None):
+        x_max, table = table or self._interpolation_table()
+        inside = (x >= 0) & (x <= x_max)
+        integrals = np.empty((3,) + x.shape)
+        rows = table(x[inside])
+        integrals[:2, inside] = x[inside]*rows[:2]
+        integrals[2, inside] = np.exp(rows[2])
+        outside = ~inside
+        if np.any(outside):
+            integrals[:, outside] = self._direct_integrals(x[outside])
+        return integrals
+
+    def _los_integral(self, z):
+        return self._integrals(z, age=False)[0]
+
+    def _lookback_integral(self, z):
+        return self._integrals(z, los=False)[1]
+
+    def _age_integral(self, z):
+        return self._integrals(z, los=False)[2]
+
+    def _pair_los_integrals(self, z1, z2):
+        """
+        Returns the line-of-sight integrals to z1 and to z2, looked up from the interpolation
+        table of the table mode or otherwise from a table up to TABLE_Z_MAX at the profile's
+        table_rtol, shared per cosmology through the result cache. Cosmologies that cannot
+        be tabulated that far are integrated directly.
+        """
+        x1, x2 = np.log1p(z1), np.log1p(z2)
+        settings = self._table_settings or (TABLE_Z_MAX, self._profile['table_rtol'])
+        try:
+            table = self._shared_table(*settings)
+        except ValueError:
+            return self._direct_integrals(x1, age=False)[0], self._direct_integrals(x2, age=False)[0]
+        return self._table_integrals(x1, table)[0], self._table_integrals(x2, table)[0]
+
+    def _age_today_integral(self):
+        # computed once per parameter set and shared through the result cache
+        if self.closed_form is not None:
+            return float(closed_forms[self.closed_form](0.0, self.omega_M, self.omega_Lambda)[2])
+        return result_cache.get_or_compute((self._cache_key, 'age_today'), lambda: float(
+            disk_cache.get_or_compute(self._disk_key('age_today'),
+                                      lambda: {'value': self._scale_factor_integral(1.0)})['value']))
+
+    @property
+    def _hubble_time(self):
+        # 1/H0 in Gyr
+        return 1/self.H0 * float(mpc)/float(seconds_in_a_year)/(1e9)
+
+    def _transverse_distance(self, freidman_integral):
         if self.omega_k < -1.e-15:  # closed universe
-            r = self.DH / np.sqrt(abs(self.omega_k)) * \
+            return self.DH / np.sqrt(abs(self.omega_k)) * \
                 np.sin(np.sqrt(abs(self.omega_k))*freidman_integral)
         elif self.omega_k <= 1.e-15:  # flat universe
-            r = self.DH*freidman_integral
+            return self.DH*freidman_integral
         else:  # open universe
-            r = self.DH / np.sqrt(self.omega_k) * \
+            return self.DH / np.sqrt(self.omega_k) * \
                 np.sinh(np.sqrt(self.omega_k)*freidman_integral)
-        return r
-
-    def luminosity_distance(self, z):
-        return self.comoving_distance(z) * (1+z)
-
-    def angular_diameter_distance(self, z):
-        return self.comoving_distance(z) / (1+z)
-
-    def comoving_volume_element(self, z):
-        Vc_elt = self.DH * \
-            (self.angular_diameter_distance(z)**2 * (1+z)**2 / self._E(z))
-        return Vc_elt *1e-9
 
-    def comoving_volume(self, z):
-        r = self.comoving_distance(z)
+    def _comoving_volume(self, r):
+        y = self.omega_k*(r/self.DH)**2
+        if np.all(np.abs(y) < VOLUME_SERIES_LIMIT):
+            return _small_curvature_volume(r, y)
         if self.omega_k < -1.e-15:  # closed universe
             Vc = ((4*np.pi*self.DH**3)/(2*self.omega_k))*(r/self.DH*np.sqrt(1+self.omega_k*(r/self.DH)**2)
                                                           - 1/np.sqrt(abs(self.omega_k))*np.arcsin(np.sqrt(abs(self.omega_k))*r/self.DH))/(1e9)
@@ -249,107 +1617,1163 @@ class Cosmocalc:
         else:
             Vc = ((4*np.pi*self.DH**3)/(2*self.omega_k))*((r/self.DH)*np.sqrt(1+self.omega_k*(r/self.DH)**2)
                                                           - 1/np.sqrt(abs(self.omega_k))*np.arcsinh(np.sqrt(abs(self.omega_k))*r/self.DH))/(1e9)
-        return Vc
+        return np.where(np.abs(y) < VOLUME_SERIES_LIMIT, _small_curvature_volume(r, y), Vc)
 
-    def distance_modulus(self, z):
-        return 5 * np.log10(self.luminosity_distance(z) * 10**5)
+    def _comoving_volume_element(self, z, r):
+        Vc_elt = self.DH * \
+            ((r/(1+z))**2 * (1+z)**2 / self._E(z))
+        return Vc_elt *1e-9
+
+    @_instrumented
+    def comoving_distance(self, z):
+        z = np.asarray(z, dtype=float)
+        return _as_output(self._transverse_distance(self._los_integral(z)), z)
+
+    @_instrumented
+    def luminosity_distance(self, z):
+        z = np.asarray(z, dtype=float)
+        return _as_output(self.comoving_distance(z) * (1+z), z)
+
+    @_instrumented
+    def angular_diameter_distance(self, z):
+        z = np.asarray(z, dtype=float)
+        return _as_output(self.comoving_distance(z) / (1+z), z)
+
+    @_instrumented
+    def angular_diameter_distance_z1z2(self, z1, z2):
+        """
+        Calculates the angular diameter distance of a source at z2 seen from z1, e.g. for
+        lens-source pairs. Both integrals come from one interpolation table per cosmology,
+        see `_pair_los_integrals`, and the curvature is handled as for `comoving_distance`.
+
+        Args:
+            z1 (float or np.ndarray): Redshift(s) of the observer, e.g. the lens.
+            z2 (float or np.ndarray): Redshift(s) of the source, broadcast against z1.
+
+        Returns:
+            float or np.ndarray: The distances in Mpc, negative where z2 < z1.
+        """
+        z1, z2 = np.broadcast_arrays(np.asarray(z1, dtype=float), np.asarray(z2, dtype=float))
+        chi1, chi2 = self._pair_los_integrals(z1, z2)
+        return _as_output(self._transverse_distance(chi2 - chi1)/(1+z2), z2)
+
+    @_instrumented
+    def critical_surface_density(self, z_lens, z_source):
+        """
+        Calculates the critical surface density for lensing, c^2 D_s/(4 pi G D_l D_ls).
+
+        Args:
+            z_lens (float or np.ndarray): Redshift(s) of the lens.
+            z_source (float or np.ndarray): Redshift(s) of the source, broadcast against z_lens.
+
+        Returns:
+            float or np.ndarray: The critical surface density in solar masses per pc^2,
+                inf where the source is not behind the lens.
+        """
+        z_lens, z_source = np.broadcast_arrays(np.asarray(z_lens, dtype=float), np.asarray(z_source, dtype=float))
+        chi_lens, chi_source = self._pair_los_integrals(z_lens, z_source)
+        lens = self._transverse_distance(chi_lens)/(1+z_lens)
+        source = self._transverse_distance(chi_source)/(1+z_source)
+        lens_source = self._transverse_distance(chi_source - chi_lens)/(1+z_source)
+        # c^2/(4 pi G) in kg/m, over distances in Mpc, converted to solar masses per pc^2
+        scale = (1e3*c)**2/(4*np.pi*gravitational_constant)/(1e3*mpc)*(1e-3*mpc)**2/solar_mass
+        with np.errstate(divide='ignore'):
+            density = np.where(lens_source > 0, scale*source/(lens*np.where(lens_source > 0, lens_source, 1)), np.inf)
+        return _as_output(density, z_source)
+
+    @_instrumented
+    def comoving_volume_element(self, z):
+        z = np.asarray(z, dtype=float)
+        return _as_output(self._comoving_volume_element(z, self.comoving_distance(z)), z)
 
-    def _calculate_age_universe(self, t_i, t_f):
-        return 1/self.H0*quad(_tage_int, t_i, t_f, args=(self.omega_M, self.omega_k, self.omega_rad, self.omega_Lambda, self.w, self.wa))[0]\
-            * float(mpc)/float(seconds_in_a_year)/(1e9)
+    @_instrumented
+    def comoving_volume(self, z):
+        z = np.asarray(z, dtype=float)
+        return _as_output(self._comoving_volume(self.comoving_distance(z)), z)
+
+    @_instrumented
+    def distance_modulus(self, z):
+        z = np.asarray(z, dtype=float)
+        return _as_output(5 * np.log10(self.luminosity_distance(z) * 10**5), z)
 
+    @_instrumented
     def light_travel_time(self, z):
-        return self._calculate_age_universe(0, z)
+        z = np.asarray(z, dtype=float)
+        return _as_output(self._hubble_time*self._lookback_integral(z), z)
 
+    @_instrumented
     def age_at_z(self, z):
-        return self._calculate_age_universe(z, np.inf)
+        z = np.asarray(z, dtype=float)
+        return _as_output(self._hubble_time*self._age_integral(z), z)
+
+    @_instrumented
+    def age_today(self, z=None):
+        return self._hubble_time*self._age_today_integral()
+
+    @_instrumented
+    def evaluate(self, z, quantities=None):
+        """
+        Evaluates several quantities at the redshift(s) z, sharing one line-of-sight
+        integral and one age integral between all of them.
+
+        Args:
+            z (float or np.ndarray): Redshift(s).
+            quantities (list, optional): Names of the quantities to evaluate, taken from
+                `result_quantities`. Defaults to all of them.
+
+        Returns:
+            dict: The value of each requested quantity, keyed by its name. Values are floats
+                for a scalar z and arrays with the shape of z otherwise. Results for up to
+                RESULT_CACHE_MAX_ARRAY_SIZE redshifts are kept in the process-wide
+                `result_cache`, and the cached arrays are read-only.
+
+        Raises:
+            ValueError: If a requested quantity is not supported.
+        """
+        quantities = list(result_quantities if quantities is None else quantities)
+        unknown = [q for q in quantities if q not in result_quantities]
+        if unknown:
+            raise ValueError(f'Unsupported quantities: {unknown}')
+        z = np.asarray(z, dtype=float)
+        if z.size > RESULT_CACHE_MAX_ARRAY_SIZE:
+            return self._evaluate(z, quantities)
+        # cached arrays are shared between callers, so they are made read-only
+        values = result_cache.get_or_compute(
+            (self._cache_key, 'evaluate', self._table_settings, tuple(quantities), _array_key(z)),
+            lambda: {q: _read_only(v) for q, v in self._evaluate(z, quantities).items()})
+        return dict(values)
+
+    def _evaluate(self, z, quantities):
+        los, lookback, age = self._integrals(z,
+                                             los=any(q in distance_quantities for q in quantities),
+                                             age=any(q in ('age_at_z', 'light_travel_time') for q in quantities))
+        values = {}
+        if los is not None:
+            r = self._transverse_distance(los)
+            values.update({
+                'comoving_distance': r,
+                'angular_diameter_distance': r/(1+z),
+                'luminosity_distance': r*(1+z),
+                'comoving_volume': self._comoving_volume(r),
+                'comoving_volume_element': self._comoving_volume_element(z, r),
+                'distance_modulus': 5 * np.log10(r*(1+z) * 10**5),
+            })
+        if lookback is not None:
+            values['light_travel_time'] = self._hubble_time*lookback
+            values['age_at_z'] = self._hubble_time*age
+        if 'age_today' in quantities:
+            values['age_today'] = np.full(z.shape, self._hubble_time*self._age_today_integral())
+        return {q: _as_output(values[q], z) for q in quantities}
+
+    @_instrumented
+    def jacobian(self, z, quantities=None):
+        """
+        Evaluates quantities at the redshift(s) z together with their derivatives with
+        respect to the parameters in `cosmo_input_params`.
+
+        The derivatives of 1/E(z) are integrated alongside 1/E(z) itself in one vectorized
+        pass, so they carry the quadrature accuracy of the profile in use instead of the
+        noise of finite differences. The integrals are always computed numerically,
+        whether or not the cosmology has closed forms or the table mode is on. omega_k
+        follows the densities, 1 - omega_M - omega_Lambda - omega_rad. With a w(z) model
+        the rows of w and wa are zero.
+
+        Args:
+            z (float or np.ndarray): Redshift(s).
+            quantities (list, optional): Names of the quantities, taken from
+                `jacobian_quantities`. Defaults to all of them.
+
+        Returns:
+            tuple: A dict of the value of each quantity, as from `evaluate`, and a dict of
+                their derivatives, arrays of shape (len(cosmo_input_params),) + np.shape(z)
+                whose rows follow the order of `cosmo_input_params`.
+
+        Raises:
+            ValueError: If a requested quantity is not supported.
+        """
+        quantities = list(jacobian_quantities if quantities is None else quantities)
+        unknown = [q for q in quantities if q not in jacobian_quantities]
+        if unknown:
+            raise ValueError(f'Unsupported quantities: {unknown}')
+        z = np.asarray(z, dtype=float)
+        (chi, *d_chi), (lookback, *d_lookback), (age, *d_age) = self._gradient_integrals(np.log1p(z))
+        d_chi, d_lookback, d_age = np.array(d_chi), np.array(d_lookback), np.array(d_age)
+        H0 = cosmo_input_params.index('H0')
+        # only H0 scales the distances and times, and only the densities change omega_k
+        r = self._transverse_distance(chi)
+        if self.omega_k < -1.e-15:
+            d_r = self.DH*np.cos(np.sqrt(-self.omega_k)*chi)*d_chi
+        elif self.omega_k <= 1.e-15:
+            d_r = self.DH*d_chi
+        else:
+            d_r = self.DH*np.cosh(np.sqrt(self.omega_k)*chi)*d_chi
+        d_curvature = self.DH*_transverse_curvature_derivative(self.omega_k, chi)
+        for p in ('omega_rad', 'omega_M', 'omega_Lambda'):
+            d_r[cosmo_input_params.index(p)] -= d_curvature
+        d_r[H0] = -r/self.H0
+        d_lookback[H0], d_age[H0] = -lookback/self.H0, -age/self.H0
+        age_today, *d_age_today = self._age_today_gradient()
+        d_age_today = np.array(d_age_today)
+        d_age_today[H0] = -age_today/self.H0
+        values = {
+            'comoving_distance': (r, d_r),
+            'angular_diameter_distance': (r/(1+z), d_r/(1+z)),
+            'luminosity_distance': (r*(1+z), d_r*(1+z)),
+            'distance_modulus': (5*np.log10(r*(1+z)*10**5), 5/np.log(10)*d_r/r),
+            'light_travel_time': (self._hubble_time*lookback, self._hubble_time*d_lookback),
+            'age_at_z': (self._hubble_time*age, self._hubble_time*d_age),
+            'age_today': (np.full(z.shape, self._hubble_time*age_today),
+                          np.broadcast_to((self._hubble_time*d_age_today).reshape((-1,) + (1,)*z.ndim),
+                                          (len(cosmo_input_params),) + z.shape).copy()),
+        }
+        return ({q: _as_output(values[q][0], z) for q in quantities},
+                {q: values[q][1] for q in quantities})
+
+    def _inverse_table_values(self, quantity, x, table):
+        # the quantity and its derivative with respect to x = ln(1+z), from the one table row it needs
+        from scipy.interpolate import PPoly
+        row = {'light_travel_time': 1, 'age_at_z': 2}.get(quantity, 0)
+        tabulated = PPoly.construct_fast(table.c[..., row], table.x)(x)
+        z = np.expm1(x)
+        freidman = self._freidman(z)
+        if quantity == 'light_travel_time':
+            return self._hubble_time*x*tabulated, self._hubble_time*freidman
+        if quantity == 'age_at_z':
+            return self._hubble_time*np.exp(tabulated), -self._hubble_time*freidman
+        los = x*tabulated
+        r = self._transverse_distance(los)
+        if quantity == 'comoving_volume':
+            # the volume grows as z^3 at low redshift, its cube root is inverted instead
+            volume_root = np.cbrt(self._comoving_volume(r))
+            return volume_root, 4*np.pi*(1+z)*self._comoving_volume_element(z, r)/(3*volume_root**2)
+        sqrt_k = np.sqrt(abs(self.omega_k))
+        if self.omega_k < -1.e-15:  # closed universe
+            slope = np.cos(sqrt_k*los)
+        elif self.omega_k <= 1.e-15:  # flat universe
+            slope = 1
+        else:  # open universe
+            slope = np.cosh(sqrt_k*los)
+        dr = self.DH*slope*(1+z)*freidman
+        if quantity == 'luminosity_distance':
+            return r*(1+z), (r + dr)*(1+z)
+        return r, dr
+
+    @_instrumented
+    def z_at(self, quantity: str, values, z_max: float = TABLE_Z_MAX):
+        """
+        Finds the redshifts at which a quantity takes the given values.
+
+        The relation is inverted in bulk from the cached interpolation table of this cosmology:
+        a linear interpolation over the table nodes gives a first guess, which is polished
+        with Newton steps using the exact derivative of the quantity.
+
+        Args:
+            quantity (str): One of `invertible_quantities`.
+            values (float or np.ndarray): Target values, in the units of the quantity.
+            z_max (float): Maximum redshift searched.
+
+        Returns:
+            float or np.ndarray: The redshifts. Targets outside the range covered between
+                z=0 and z_max give nan.
+
+        Raises:
+            ValueError: If the quantity is not invertible, or is not monotonic in z
+                for this cosmology (e.g. the turnover of distances in a closed universe).
+        """
+        if quantity not in invertible_quantities:
+            raise ValueError(f'{quantity} cannot be inverted, choose one of {invertible_quantities}')
+        targets = np.asarray(values, dtype=float)
+        if quantity == 'distance_modulus':
+            quantity, targets = 'luminosity_distance', 10**(targets/5 - 5)
+        elif quantity == 'comoving_volume':
+            targets = np.cbrt(targets)
+        x_max, table = self._shared_table(float(z_max), INVERSE_TABLE_RTOL)
+        nodes = table.x
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # the volume's derivative is 0/0 at z = 0
+            node_values = self._inverse_table_values(quantity, nodes, table)[0]
+        if not np.all(np.isfinite(node_values)):
+            raise ValueError(f'{quantity} is not defined up to z={z_max} for this cosmology')
+        steps = np.diff(node_values)
+        if not (np.all(steps > 0) or np.all(steps < 0)):
+            raise ValueError(f'{quantity} is not monotonic in z up to z={z_max} for this cosmology, '
+                             'so it cannot be inverted')
+        from scipy.interpolate import CubicSpline
+        order = slice(None) if steps[0] > 0 else slice(None, None, -1)
+        inside = (targets >= node_values.min()) & (targets <= node_values.max())
+        x = np.where(inside, CubicSpline(node_values[order], nodes[order])(targets), np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for _ in range(NEWTON_ITERATIONS):
+                value, slope = self._inverse_table_values(quantity, x, table)
+                step = (value - targets)/slope
+                x = np.clip(x - np.where(np.isfinite(step), step, 0), 0, x_max)
+        return _as_output(np.expm1(x), values)
+
+    @_instrumented
+    def sample_redshifts(self, z_min: float, z_max: float, quantities=None, max_points: int = ADAPTIVE_MAX_POINTS,
+                         rtol: float = ADAPTIVE_RTOL, initial_points: int = ADAPTIVE_INITIAL_POINTS):
+        """
+        Chooses redshifts between z_min and z_max adapted to the shape of the quantities,
+        e.g. for plotting them against log z.
+
+        Starting from `initial_points` redshifts evenly spaced in log z, every interval
+        whose midpoint deviates from the straight line between its ends by more than
+        rtol times the quantity's range is split, for any of the quantities. The intervals
+        with the largest deviations are split first until `max_points` is reached. Nearly
+        linear stretches therefore keep few samples, while bends get many. All quantities
+        share the same redshifts.
+
+        Args:
+            z_min (float): Lowest redshift, must be positive.
+            z_max (float): Highest redshift.
+            quantities (list, optional): Names taken from `result_quantities`. Defaults to all.
+            max_points (int): Maximum number of redshifts.
+            rtol (float): Tolerated interpolation error relative to the range of each quantity.
+            initial_points (int): Number of redshifts of the first, even sampling.
+
+        Returns:
+            tuple: The sorted redshifts as an np.ndarray, and a dict of the value arrays of
+                every quantity at those redshifts. The results are kept in the process-wide
+                `result_cache`, and the cached arrays are read-only.
+
+        Raises:
+            ValueError: If a requested quantity is not supported or the range is invalid.
+        """
+        quantities = list(result_quantities if quantities is None else quantities)
+        unknown = [q for q in quantities if q not in result_quantities]
+        if unknown:
+            raise ValueError(f'Unsupported quantities: {unknown}')
+        if not 0 < z_min < z_max:
+            raise ValueError('The redshift range must satisfy 0 < z_min < z_max')
+        z, values = result_cache.get_or_compute(
+            (self._cache_key, 'sample', self._table_settings, tuple(quantities),
+             float(z_min), float(z_max), max_points, rtol, initial_points),
+            lambda: self._sample_redshifts(z_min, z_max, quantities, max_points, rtol, initial_points))
+        return z, dict(values)
+
+    def _sample_redshifts(self, z_min, z_max, quantities, max_points, rtol, initial_points):
+        u = np.linspace(np.log(z_min), np.log(z_max), min(initial_points, max_points))
+        values = np.array([self._evaluate(np.exp(u), quantities)[q] for q in quantities]).reshape(len(quantities), -1)
+        while len(u) < max_points:
+            midpoints = (u[1:] + u[:-1])/2
+            new_values = np.array([self._evaluate(np.exp(midpoints), quantities)[q]
+                                   for q in quantities]).reshape(len(quantities), -1)
+            with np.errstate(invalid='ignore'):
+                scale = np.nanmax(values, axis=1, keepdims=True) - np.nanmin(values, axis=1, keepdims=True)
+                error = np.abs(new_values - (values[:, 1:] + values[:, :-1])/2)/np.where(scale > 0, scale, 1)
+            error = np.nanmax(np.where(np.isfinite(error), error, 0), axis=0, initial=0)
+            split = np.argsort(-error)[:max_points - len(u)]
+            split = np.sort(split[error[split] > rtol])
+            if not len(split):
+                break
+            # every split midpoint goes in right after the left end of its interval
+            u = np.insert(u, split + 1, midpoints[split])
+            values = np.insert(values, split + 1, new_values[:, split], axis=1)
+        return _read_only(np.exp(u)), {q: _read_only(v) for q, v in zip(quantities, values)}
+
+    def _growth_solution(self):
+        # the growth rate f = dlnD/dlna and ln D over ln(a), solved once per parameter set
+        return result_cache.get_or_compute((self._cache_key, 'growth'), self._solve_growth)
+
+    def _solve_growth(self):
+        """
+        Integrates the linear growth equation of matter perturbations, written for ln D and
+        f = dlnD/dlna as functions of N = ln(a):
+            dlnD/dN = f,  df/dN = -f^2 - (2 + dlnE/dN) f + 3/2 omega_M(a)
+        from GROWTH_START_Z to today with a dense output. Returns the solution and ln D today.
+        """
+        from scipy.integrate import solve_ivp
+
+        def derivatives(N, y):
+            a = np.exp(N)
+            # dln(rho_DE)/dN = -3(1 + w)
+            dark_energy = self.omega_Lambda*self._dark_energy_density(1/a - 1)
+            E2 = self.omega_M/a**3 + self.omega_k/a**2 + self.omega_rad/a**4 + dark_energy
+            dE2 = (-3*self.omega_M/a**3 - 2*self.omega_k/a**2 - 4*self.omega_rad/a**4
+                   - 3*dark_energy*(1 + self._equation_of_state(1/a - 1)))
+            f = y[1]
+            return [f, -f**2 - (2 + dE2/(2*E2))*f + 1.5*self.omega_M/a**3/E2]
+
+        start = -np.log1p(GROWTH_START_Z)
+        a_start, a_eq = np.exp(start), self.omega_rad/self.omega_M
+        solution = solve_ivp(derivatives, (start, 0.0),
+                             [np.log(a_start + 2/3*a_eq), a_start/(a_start + 2/3*a_eq)],
+                             method='DOP853', dense_output=True, rtol=GROWTH_RTOL_FACTOR*self._profile['rtol'],
+                             atol=GROWTH_RTOL_FACTOR*self._profile['rtol'], max_step=GROWTH_MAX_STEP)
+        if not solution.success:
+            raise ValueError(f'The growth equation could not be integrated: {solution.message}')
+        return solution.sol, float(solution.y[0, -1])
+
+    def _growth(self, z):
+        # ln D(z) - ln D(0) and f(z)
+        z = np.asarray(z, dtype=float)
+        if self.omega_M <= 0:  # no matter, nothing grows
+            return np.where(np.isfinite(z), 0.0, np.nan), np.where(np.isfinite(z), 0.0, np.nan)
+        solution, log_today = self._growth_solution()
+        N = -np.log1p(z)
+        early = N < -np.log1p(GROWTH_START_Z)
+        growth = solution(np.where(early | ~np.isfinite(N), 0.0, N).ravel()).reshape((2,) + z.shape)
+        # beyond the start, the growing mode of matter and radiation
+        a, a_eq = np.exp(N[early]), self.omega_rad/self.omega_M
+        growth[:, early] = np.log(a + 2/3*a_eq), a/(a + 2/3*a_eq)
+        growth[:, ~np.isfinite(N)] = np.nan
+        return growth[0] - log_today, growth[1]
+
+    @_instrumented
+    def growth_factor(self, z):
+        """
+        Calculates the linear growth factor D(z) of matter perturbations, normalized to
+        D(0) = 1. The growth equation is integrated once per parameter set and the dense
+        solution is kept in the process-wide `result_cache`, so later calls, and
+        growth_rate, only interpolate it.
+
+        Args:
+            z (float or np.ndarray): Redshift(s).
+
+        Returns:
+            float or np.ndarray: The growth factor.
+        """
+        return _as_output(np.exp(self._growth(z)[0]), z)
+
+    @_instrumented
+    def growth_rate(self, z):
+        """
+        Calculates the linear growth rate f(z) = dlnD/dlna, from the same cached solution
+        as growth_factor.
+
+        Args:
+            z (float or np.ndarray): Redshift(s).
+
+        Returns:
+            float or np.ndarray: The growth rate.
+        """
+        return _as_output(self._growth(z)[1], z)
+
+    @_instrumented
+    def draw_redshifts(self, n: int, z_min: float, z_max: float, weight=None, seed=None):
+        """
+        Draws redshifts distributed as the comoving volume element dV/dz, optionally
+        times a weight such as a rate or a luminosity function integral, e.g. for mock catalogs.
+
+        The cumulative weighted volume between z_min and z_max is integrated once and
+        inverted on a table of evenly spaced cube roots of the volume counted from z=0,
+        which is kept in the process-wide `result_cache`. The cube root keeps the table
+        accurate at low redshift, where the volume grows as z**3. Each draw is then one
+        uniform random number, its cube root and one linear interpolation in the table, so
+        tens of millions of redshifts take about a second.
+
+        Args:
+            n (int): Number of redshifts.
+            z_min (float): Lowest redshift, non-negative.
+            z_max (float): Highest redshift.
+            weight (callable, optional): Vectorized function of the redshift returning
+                non-negative weights. The table is cached per function object.
+            seed (int or np.random.Generator, optional): Seed or generator of the uniform
+                numbers, passed to np.random.default_rng.
+
+        Returns:
+            np.ndarray: n redshifts, in the order drawn.
+
+        Raises:
+            ValueError: If the range is invalid or the weighted volume in it is not
+                positive and finite.
+        """
+        if not 0 <= z_min < z_max:
+            raise ValueError('The redshift range must satisfy 0 <= z_min < z_max')
+        sampler = result_cache.get_or_compute(
+            (self._cache_key, 'volume_sampler', self._table_settings, float(z_min), float(z_max), weight),
+            lambda: self._volume_sampler_table(z_min, z_max, weight))
+        table, root_min = sampler['z'], float(sampler['root_min'])
+        u = np.cbrt(root_min**3 + (1 - root_min**3)*np.random.default_rng(seed).random(n))
+        u = (u - root_min)*((len(table) - 1)/(1 - root_min))
+        k = np.minimum(u.astype(np.intp), len(table) - 2)
+        u -= k
+        return table[k] + u*(table[k + 1] - table[k])
+
+    def _volume_sampler_table(self, z_min, z_max, weight):
+        # unweighted tables are also kept in the disk cache, weight functions cannot be
+        # recognized across processes
+        if weight is not None:
+            return self._volume_quantile_table(z_min, z_max, weight)
+        sampler = disk_cache.get_or_compute(
+            self._disk_key('volume_sampler_cbrt', self._table_settings, float(z_min), float(z_max)),
+            lambda: self._volume_quantile_table(z_min, z_max, None))
+        return {name: _read_only(values) for name, values in sampler.items()}
+
+    def _volume_quantile_table(self, z_min, z_max, weight):
+        # redshifts at evenly spaced cube roots of (offset + q)/(offset + 1) for the quantile q
+        # of the weighted volume, integrated in x = ln(1+z). The offset is the unweighted
+        # volume below z_min relative to that in the range, so that the cube root grows about
+        # as the comoving distance from any z_min on, and z is nearly linear in it
+        def integrand(x):
+            z = np.expm1(x)
+            density = self._comoving_volume_element(z, self._transverse_distance(self._los_integral(z)))*(1+z)
+            return density if weight is None else density*weight(z)
+        x = np.linspace(np.log1p(z_min), np.log1p(z_max), VOLUME_SAMPLER_NODES)
+        cumulative = self._quadrature(integrand, x, x0=x[0])
+        if not (np.all(np.isfinite(cumulative)) and cumulative[-1] > 0):
+            raise ValueError(f'The weighted comoving volume between z={z_min} and z={z_max} '
+                             'is not positive and finite for this cosmology')
+        volumes = self._comoving_volume(self._transverse_distance(self._los_integral(np.array([z_min, z_max]))))
+        offset = volumes[0]/(volumes[1] - volumes[0])
+        if not (np.isfinite(offset) and offset >= 0):
+            offset = 0.  # e.g. beyond the antipode of a closed universe
+        root_min = np.cbrt(offset/(offset + 1))
+        roots = np.linspace(root_min, 1, VOLUME_SAMPLER_QUANTILES)
+        table = np.expm1(np.interp(roots, np.cbrt((offset + cumulative/cumulative[-1])/(offset + 1)), x))
+        return {'z': _read_only(table), 'root_min': _read_only(np.array(root_min))}
+
+    @_instrumented
+    def bin_volumes(self, z_edges, sky_area: float = FULL_SKY):
+        """
+        Calculates the comoving volumes of redshift bins over a patch of sky, from one
+        vectorized evaluation of the comoving volume at all bin edges.
+
+        Args:
+            z_edges (np.ndarray): Increasing bin edges, n + 1 of them for n bins.
+            sky_area (float): Survey area in square degrees, the full sky by default.
+
+        Returns:
+            np.ndarray: The n bin volumes in Gpc^3.
+
+        Raises:
+            ValueError: If there are fewer than two edges or they are not increasing.
+        """
+        z_edges = np.asarray(z_edges, dtype=float)
+        if z_edges.ndim != 1 or len(z_edges) < 2 or not np.all(np.diff(z_edges) > 0):
+            raise ValueError('z_edges must be at least two increasing redshifts')
+        return np.diff(self._comoving_volume(self._transverse_distance(self._los_integral(z_edges))))*sky_area/FULL_SKY
+
+
+# -------------------------------functional API
+# every function broadcasts its redshift and parameter arguments against each other, so
+# e.g. parameter arrays of shape (N, 1) and redshifts of shape (M,) give an (N, M) result
+# from one batched computation; when every argument is scalar the result is a python
+# float, as from the Cosmocalc methods
+
+
+def _functional(func):
+    @wraps(func)
+    def wrapper(*args):
+        value = np.asarray(func(*args))
+        return float(value) if value.ndim == 0 else value
+    return wrapper
+
+
+def _broadcast_integral(integrand, x, params, order: int = GL_ORDER, max_width: float = GL_PANEL_WIDTH):
+    """
+    Integrates `integrand(t, *params)` from 0 to x for broadcast arrays of x and params.
+
+    The parameters are broadcast against each other and integrated once over a grid of
+    panels shared by all upper limits, giving a cumulative integral per parameter set.
+    Each upper limit then only adds one Gauss-Legendre panel from the grid point below it.
 
-    def age_today(self, z):
-        return self._calculate_age_universe(0, np.inf)
+    Args:
+        integrand (callable): Vectorized function of the nodes and the parameters.
+        x (float or np.ndarray): Upper integration limits.
+        params (tuple): Parameters of the integrand, broadcastable against x.
+        order (int): Number of Gauss-Legendre nodes per panel.
+        max_width (float): Maximum width of the grid panels.
+
+    Returns:
+        np.ndarray: The integrals, with the broadcast shape of x and params.
+    """
+    params = np.broadcast_arrays(*[np.asarray(p, dtype=float) for p in params])
+    x = np.asarray(x, dtype=float)
+    shape = np.broadcast_shapes(params[0].shape, x.shape)
+    finite = np.isfinite(x)
+    x_top = max(np.max(x[finite], initial=0), 0)
+    n_panels = max(int(np.ceil(x_top/max_width)), 1)
+    width = x_top/n_panels if x_top > 0 else max_width
+    nodes, weights = _gauss_legendre(order)
+    grid_nodes = width*(np.arange(n_panels)[:, None] + nodes)
+    panels = (integrand(grid_nodes, *[p[..., None, None] for p in params]) @ weights) * width
+    cumulative = np.concatenate((np.zeros(panels.shape[:-1] + (1,)), np.cumsum(panels, axis=-1)), axis=-1)
+    x = np.where(finite, x, 0)
+    k = np.clip(np.floor(x/width), 0, n_panels - 1).astype(int)
+    start = k*width
+    partial = (integrand(start[..., None] + (x - start)[..., None]*nodes, *[p[..., None] for p in params])
+               @ weights) * (x - start)
+    base = np.take_along_axis(np.broadcast_to(cumulative, shape + cumulative.shape[-1:]),
+                              np.broadcast_to(k, shape)[..., None], axis=-1)[..., 0]
+    return np.where(finite, base + partial, np.nan)
 
 
 def _E(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
     return np.sqrt(omega_M*(1+z)**3 + omega_k*(1+z)**2 + omega_rad*(1+z)**4
-                   + omega_Lambda*(1+z)**(3*(1+w+wa))*math.exp(-3*wa*(1-1/(1+z))))
+                   + omega_Lambda*(1+z)**(3*(1+w+wa))*np.exp(-3*wa*(1-1/(1+z))))
 
 
 def _freidman(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
     return 1/_E(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa)
 
 
-
 def _tage_int(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
     return 1/((1+z)*_E(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa))
 
 
+def _los_integral(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
+    # integral of dz/E(z) in x = ln(1+z)
+    return _broadcast_integral(lambda x, *p: np.exp(x)*_freidman(np.expm1(x), *p),
+                               np.log1p(z), (omega_M, omega_k, omega_rad, omega_Lambda, w, wa))
 
-def comoving_distance(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa, DH):
-    freidman_integral = float(quad(_freidman, 0, z, args=(
-        omega_M, omega_k, omega_rad, omega_Lambda, w, wa)))
-    if omega_k < -1.e-15:  # closed universe
-        r = DH / np.sqrt(abs(omega_k)) * \
-            np.sin(np.sqrt(abs(omega_k))*freidman_integral)
-    elif omega_k <= 1.e-15:  # flat universe
-        r = DH*freidman_integral
-    else:  # open universe
-        r = DH / np.sqrt(omega_k) * \
-            np.sinh(np.sqrt(omega_k)*freidman_integral)
-    return r
 
+def _lookback_integral(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
+    # integral of dz/((1+z)E(z)) from 0 to z, in x = ln(1+z)
+    return _broadcast_integral(lambda x, *p: _freidman(np.expm1(x), *p),
+                               np.log1p(z), (omega_M, omega_k, omega_rad, omega_Lambda, w, wa))
 
 
-def luminosity_distance(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
-    return comoving_distance(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa) * (1+z)
+def _age_integral(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
+    # integral of dz/((1+z)E(z)) from z to infinity, i.e. of da/(aE) from 0 to a = 1/(1+z),
+    # carried out in s = sqrt(a) where the integrand 2/(sE) is regular at s = 0
+    return _broadcast_integral(lambda s, *p: 2/s*_freidman(1/s**2 - 1, *p),
+                               1/np.sqrt(1+np.asarray(z, dtype=float)),
+                               (omega_M, omega_k, omega_rad, omega_Lambda, w, wa), max_width=AGE_PANEL_WIDTH)
 
 
+def _transverse_distance(freidman_integral, DH, omega_k):
+    sqrt_k = np.sqrt(np.abs(omega_k))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(omega_k < -1.e-15, DH / sqrt_k * np.sin(sqrt_k*freidman_integral),  # closed universe
+                        np.where(omega_k <= 1.e-15, DH*freidman_integral,  # flat universe
+                                 DH / sqrt_k * np.sinh(sqrt_k*freidman_integral)))  # open universe
 
-def angular_diameter_distance(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
-    return comoving_distance(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa) / (1+z)
 
+def _hubble_time(H0):
+    # 1/H0 in Gyr
+    return 1/np.asarray(H0, dtype=float) * float(mpc)/float(seconds_in_a_year)/(1e9)
 
 
-def comoving_volume_element(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa, DH):
-    Vc_elt = DH * \
-        (angular_diameter_distance(z, omega_M, omega_k, omega_rad, omega_Lambda, w,
-         wa)**2 * (1+z)**2 / _E(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa))
-    return Vc_elt
+@_functional
+def comoving_distance(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
+    return _transverse_distance(_los_integral(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa),
+                                c/np.asarray(H0, dtype=float), omega_k)
 
 
+@_functional
+def luminosity_distance(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
+    return comoving_distance(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa) * (1+np.asarray(z))
 
-def comoving_volume(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa, DH):
-    r = comoving_distance(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa)
-    if omega_k < -1.e-15:  # closed universe
-        Vc = ((4*np.pi*DH**3)/(2*omega_k))*(r/DH*np.sqrt(1+omega_k*(r/DH)**2)
-                                            - 1/np.sqrt(abs(omega_k))*np.arcsin(np.sqrt(abs(omega_k))*r/DH))/(1e9)
-    elif omega_k <= 1.e-15:  # flat universe
-        Vc = 4/3*np.pi * r**3 / (1.e9)
-    else:
-        Vc = ((4*np.pi*DH**3)/(2*omega_k))*((r/DH)*np.sqrt(1+omega_k*(r/DH)**2)
-                                            - 1/np.sqrt(abs(omega_k))*np.arcsinh(np.sqrt(abs(omega_k))*r/DH))/(1e9)
-    return Vc
 
+@_functional
+def angular_diameter_distance(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
+    return comoving_distance(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa) / (1+np.asarray(z))
 
 
-def distance_modulus(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
-    return 5 * np.log10(luminosity_distance(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa) * 10**5)
+@_functional
+def comoving_volume_element(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
+    Vc_elt = c/np.asarray(H0, dtype=float) * \
+        (angular_diameter_distance(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w,
+         wa)**2 * (1+np.asarray(z))**2 / _E(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa))
+    return Vc_elt * 1e-9
 
 
+@_functional
+def comoving_volume(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
+    DH = c/np.asarray(H0, dtype=float)
+    r = comoving_distance(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa)
+    sqrt_k = np.sqrt(np.abs(omega_k))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        curved = (4*np.pi*DH**3)/(2*omega_k)*(r/DH*np.sqrt(1+omega_k*(r/DH)**2)
+                                              - np.where(omega_k < 0, np.arcsin(sqrt_k*r/DH),
+                                                         np.arcsinh(sqrt_k*r/DH))/sqrt_k)/(1e9)
+        y = omega_k*(r/DH)**2
+        return np.where(np.abs(y) < VOLUME_SERIES_LIMIT, _small_curvature_volume(r, y), curved)
 
-def _calculate_age_universe(t_i, t_f, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
-    return 1/H0*quad(_tage_int, a=t_i, b=t_f, args=(omega_M, omega_k, omega_rad, omega_Lambda, w, wa))*(mpc)/(seconds_in_a_year)/(1e9)
+
+@_functional
+def distance_modulus(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
+    return 5 * np.log10(luminosity_distance(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa) * 10**5)
 
 
 # lookback time, Gyr
 
+@_functional
 def light_travel_time(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):
-    return _calculate_age_universe(0, z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa)
-
+    # integrated from 0 to z directly, as the difference of two ages would cancel at low z
+    return _hubble_time(H0)*_lookback_integral(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa)
 
 
+@_functional
 def age_at_z(z, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):  # age at z, Gyr
-    return _calculate_age_universe(z, np.inf, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa)
-
+    return _hubble_time(H0)*_age_integral(z, omega_M, omega_k, omega_rad, omega_Lambda, w, wa)
 
 
+@_functional
 def age_today(H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa):  # age today, Gyr
-    return _calculate_age_universe(0, np.inf, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa)
+    return age_at_z(0, H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa)
+
+
+# -------------------------------parameter sweeps
+SWEEP_CHUNK_SIZE = 256  # parameter sets per task
+
+# set in every sweep worker by _init_sweep_worker
+_sweep_state = {}
+
+
+def _parameter_table(params):
+    """
+    Returns an (N, 6) array of parameter sets, its columns in the order of `cosmo_input_params`.
+
+    Args:
+        params (dict or list): Either a grid, mapping every name in `cosmo_input_params`
+            to a value or a sequence of values, whose cartesian product is taken in the
+            order of `cosmo_input_params` (the last parameter varying fastest), or a list of
+            dicts each holding one full parameter set.
+
+    Raises:
+        ValueError: If a parameter set misses one of `cosmo_input_params`.
+    """
+    if isinstance(params, dict):
+        missing = [p for p in cosmo_input_params if p not in params]
+        if missing:
+            raise ValueError(f'The parameter grid is missing {missing}')
+        axes = [np.atleast_1d(np.asarray(params[p], dtype=float)) for p in cosmo_input_params]
+        return np.array(list(itertools.product(*axes)), dtype=float).reshape(-1, len(cosmo_input_params))
+    missing = [p for p in cosmo_input_params if any(p not in param_set for param_set in params)]
+    if missing:
+        raise ValueError(f'Some parameter sets are missing {missing}')
+    return np.array([[param_set[p] for p in cosmo_input_params] for param_set in params],
+                    dtype=float).reshape(-1, len(cosmo_input_params))
+
+
+def _sweep_values(quantity: str, z: np.ndarray, table: np.ndarray):
+    """
+    Evaluates a quantity for every parameter set in `table` (rows ordered as in
+    `cosmo_input_params`) at the redshifts z with the broadcasting functional API.
+    """
+    H0, w, wa, omega_rad, omega_M, omega_Lambda = [column[:, None] for column in table.T]
+    omega_k = 1 - omega_M - omega_Lambda - omega_rad
+    args = (H0, omega_M, omega_k, omega_rad, omega_Lambda, w, wa)
+    if quantity == 'age_today':
+        return np.broadcast_to(age_today(*args), (len(table), len(z)))
+    return globals()[quantity](z, *args)
+
+
+def _open_sweep_output(target, shape):
+    # attaches to the shared-memory block or memory-mapped file holding the results
+    from multiprocessing import shared_memory
+    if isinstance(target, str):
+        return None, np.load(target, mmap_mode='r+')
+    block = shared_memory.SharedMemory(name=target[0])
+    return block, np.ndarray(shape, dtype=float, buffer=block.buf)
+
+
+def _init_sweep_worker(target, shape, z, quantities):
+    _sweep_state['block'], _sweep_state['out'] = _open_sweep_output(target, shape)
+    _sweep_state['z'] = z
+    _sweep_state['quantities'] = quantities
+
+
+def _sweep_chunk(start: int, table: np.ndarray):
+    out = _sweep_state['out']
+    for i, quantity in enumerate(_sweep_state['quantities']):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[start:start + len(table), i] = _sweep_values(quantity, _sweep_state['z'], table)
+    return len(table)
+
+
+def sweep(params, z, quantities=None, processes: int = None, chunk_size: int = SWEEP_CHUNK_SIZE,
+          output: str = None, progress=None):
+    """
+    Evaluates quantities over many parameter sets in parallel.
+
+    The parameter sets are split into chunks of `chunk_size`, and every chunk is evaluated
+    in one batched computation by a pool of worker processes. The workers write their
+    results straight into a shared-memory block, or into the memory-mapped `output` file,
+    so no result is pickled. Row i of the output always belongs to parameter set i.
+
+    Args:
+        params (dict or list): A grid mapping every name in `cosmo_input_params` to one or
+            several values, expanded as a cartesian product with the last parameter varying
+            fastest, or a list of dicts with one full parameter set each.
+        z (float or np.ndarray): Redshift(s), shared by all parameter sets.
+        quantities (list, optional): Names taken from `result_quantities`. Defaults to all.
+        processes (int, optional): Number of worker processes, defaults to the number of CPUs.
+            With 1, the chunks are evaluated in this process.
+        chunk_size (int): Number of parameter sets per task.
+        output (str, optional): Path of a .npy file receiving the results. It is returned
+            memory-mapped, so results larger than memory can be kept.
+        progress (callable, optional): Called as progress(done, total) with the number of
+            parameter sets finished after every chunk.
+
+    Returns:
+        np.ndarray: The results, of shape (number of parameter sets, number of quantities,
+            number of redshifts).
+
+    Raises:
+        ValueError: If a quantity is not supported or a parameter set is incomplete.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from multiprocessing import shared_memory
+    quantities = list(result_quantities if quantities is None else quantities)
+    unknown = [q for q in quantities if q not in result_quantities]
+    if unknown:
+        raise ValueError(f'Unsupported quantities: {unknown}')
+    table = _parameter_table(params)
+    z = np.atleast_1d(np.asarray(z, dtype=float))
+    shape = (len(table), len(quantities), len(z))
+    if output is not None:
+        np.lib.format.open_memmap(output, mode='w+', dtype=float, shape=shape).flush()
+        target, block = output, None
+    else:
+        block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape))*8, 1))
+        target = (block.name,)
+    starts = range(0, len(table), chunk_size)
+    done = 0
+    try:
+        if processes == 1:
+            _init_sweep_worker(target, shape, z, quantities)
+            for start in starts:
+                done += _sweep_chunk(start, table[start:start + chunk_size])
+                if progress is not None:
+                    progress(done, len(table))
+        else:
+            with ProcessPoolExecutor(processes, initializer=_init_sweep_worker,
+                                     initargs=(target, shape, z, quantities)) as pool:
+                futures = [pool.submit(_sweep_chunk, start, table[start:start + chunk_size]) for start in starts]
+                for future in as_completed(futures):
+                    done += future.result()
+                    if progress is not None:
+                        progress(done, len(table))
+        if output is not None:
+            return np.load(output, mmap_mode='r+')
+        return np.ndarray(shape, dtype=float, buffer=block.buf).copy()
+    finally:
+        if _sweep_state.get('block') is not None:
+            _sweep_state['block'].close()
+        _sweep_state.clear()
+        if block is not None:
+            block.close()
+            block.unlink()
+
+
+# -------------------------------supernova likelihood
+
+class SupernovaLikelihood:
+    """
+    Chi-squared of supernova distance moduli on a fixed set of redshifts, for fits that
+    evaluate many parameter sets on the same data.
+
+    Everything that depends only on the data is prepared once: the Gauss-Legendre panels
+    covering the sorted, unique redshifts, the redshifts and scale factors at their nodes,
+    and the Cholesky factor of the covariance. A new parameter set then costs one vectorized
+    evaluation of 1/E(z) at the nodes, or one closed-form evaluation, and two triangular solves.
+
+    Attributes:
+        cosmo: the Cosmocalc whose parameters are updated by every call; its accuracy profile
+            sets the quadrature and its closed forms are used where they apply
+        z: redshifts of the supernovae
+        mu: observed distance moduli
+        marginalize: if True, the chi-squared is marginalized analytically over a constant
+            offset of the distance moduli, i.e. over H0 and the absolute magnitude together
+
+    Methods:
+        distance_modulus(**params):
+            Returns the model distance moduli at z for the given parameters.
+        chi2(**params):
+            Returns the chi-squared of the data for the given parameters.
+        log_likelihood(**params):
+            Returns -chi2/2.
+    """
+
+    def __init__(self, z, mu, cov, cosmo: Cosmocalc, marginalize: bool = False):
+        """
+        Args:
+            z (np.ndarray): Redshifts of the supernovae, positive and in any order.
+            mu (np.ndarray): Observed distance moduli.
+            cov (np.ndarray): Covariance matrix of mu, or a 1-d array of its variances
+                for uncorrelated errors.
+            cosmo (Cosmocalc): Calculator whose parameters are updated by every call.
+                Parameters that are not passed keep their values.
+            marginalize (bool): Whether to marginalize over H0 and the absolute magnitude.
+
+        Raises:
+            ValueError: If the shapes do not match, a redshift is not positive or the
+                covariance is not positive definite.
+        """
+        self.z = np.asarray(z, dtype=float).ravel()
+        self.mu = np.asarray(mu, dtype=float).ravel()
+        cov = np.asarray(cov, dtype=float)
+        if self.mu.shape != self.z.shape:
+            raise ValueError(f'mu has {self.mu.size} values for {self.z.size} redshifts')
+        if not np.all(self.z > 0) or not np.all(np.isfinite(self.z)):
+            raise ValueError('The redshifts must be positive and finite')
+        if cov.shape not in ((self.z.size,), (self.z.size, self.z.size)):
+            raise ValueError(f'cov of shape {cov.shape} does not match {self.z.size} redshifts')
+        if cov.ndim == 1:
+            if not np.all(cov > 0):
+                raise ValueError('The variances must be positive')
+            self._cholesky = np.sqrt(cov)
+        else:
+            try:
+                self._cholesky = np.linalg.cholesky(cov)
+            except np.linalg.LinAlgError as error:
+                raise ValueError('The covariance matrix is not positive definite') from error
+        self.cosmo = cosmo
+        self.marginalize = marginalize
+        self._x = np.log1p(self.z)
+        self._whitened_ones = self._whiten(np.ones_like(self.z))
+        self._layouts = {}
+
+    def _whiten(self, r):
+        # L^-1 r, so that r^T C^-1 r is the squared norm of the result
+        if self._cholesky.ndim == 1:
+            return r/self._cholesky
+        from scipy.linalg import solve_triangular
+        return solve_triangular(self._cholesky, r, lower=True, check_finite=False)
+
+    def _layout(self):
+        # the panels and their redshifts and scale factors, per quadrature setting
+        key = self.cosmo._profile['order'], self.cosmo._profile['panel_width']
+        if key not in self._layouts:
+            layout = _panel_layout(self._x, order=key[0], max_width=key[1])
+            self._layouts[key] = layout, np.expm1(layout.nodes), np.exp(layout.nodes)
+        return self._layouts[key]
+
+    def _los_integral(self):
+        if self.cosmo.closed_form is not None:
+            return self.cosmo._closed_form_integrals(self._x, age=False)[0]
+        layout, z_nodes, scale = self._layout()
+        return _integrate_panels(lambda _: scale*self.cosmo._freidman(z_nodes), layout)
+
+    def distance_modulus(self, **params):
+        """
+        Returns the model distance moduli at z. The parameters, keyed by names from
+        `cosmo_input_params`, are set on `cosmo` first.
+        """
+        self.cosmo.set_params(**params)
+        luminosity_distance = (1 + self.z)*self.cosmo._transverse_distance(self._los_integral())
+        return 5*np.log10(luminosity_distance) + 25
+
+    @instrumentation.timed('SupernovaLikelihood.chi2', method=True)
+    def chi2(self, **params):
+        """
+        Returns A = r^T C^-1 r for the residuals r = mu - distance_modulus(**params). When
+        marginalizing over a constant offset of mu with a flat prior, returns instead
+        A - B^2/N + ln(N/2pi), with B = 1^T C^-1 r and N = 1^T C^-1 1.
+        Cosmologies without a finite distance at every redshift give inf.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            residuals = self.mu - self.distance_modulus(**params)
+        if not np.all(np.isfinite(residuals)):
+            return np.inf
+        whitened = self._whiten(residuals)
+        a = float(whitened @ whitened)
+        if not self.marginalize:
+            return a
+        b = float(whitened @ self._whitened_ones)
+        norm = float(self._whitened_ones @ self._whitened_ones)
+        return a - b**2/norm + np.log(norm/(2*np.pi))
+
+    def log_likelihood(self, **params):
+        return -self.chi2(**params)/2
+
+
+# -------------------------------configuration
+
+PARAMS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cosmo_params.yaml')
+
+
+@lru_cache(maxsize=None)
+def load_config(path: str = PARAMS_FILE):
+    """
+    Returns the parsed parameter configuration (input_param_dict, model_dict and
+    result_dict). Each file is read once per process, so the returned dict is shared
+    and must not be modified.
+    """
+    import yaml
+    with open(path, 'r', encoding='utf-8') as file:
+        return yaml.safe_load(file)
+
+
+# -------------------------------disk cache warm-up
+
+def warm_disk_cache(directory: str = None, models=None, accuracies=('display', 'standard')):
+    """
+    Switches on the disk cache and makes sure it holds the interpolation tables and the
+    age today of the preset cosmologies, so that later processes load them instead of
+    integrating. Entries already on disk are only checked.
+
+    Args:
+        directory (str, optional): The cache directory. Defaults to the one already set,
+            or DEFAULT_DISK_CACHE_DIR.
+        models (list, optional): Names from model_dict. Defaults to all presets.
+        accuracies (tuple): Accuracy profiles to build entries for.
+
+    Returns:
+        dict: The number of entries loaded and built.
+    """
+    disk_cache.directory = directory or disk_cache.directory or DEFAULT_DISK_CACHE_DIR
+    hits, misses = disk_cache.hits, disk_cache.misses
+    model_dict = load_config()['model_dict']
+    for name in models or model_dict:
+        values = [float(model_dict[name]['param'][p]) for p in cosmo_input_params]
+        for accuracy in accuracies:
+            cosmo = Cosmocalc(*values, accuracy=accuracy)
+            cosmo.enable_tables()
+            try:
+                cosmo._interpolation_table()
+            except ValueError:
+                pass  # e.g. de Sitter, whose age diverges, is not tabulated
+            cosmo._age_today_integral()
+    return {'loaded': disk_cache.hits - hits, 'built': disk_cache.misses - misses}
+
+
+# -------------------------------command line
+# python -m cosmocalc batch catalog.parquet annotated.parquet --model planck
+
+BATCH_CHUNK_SIZE = 1_000_000
+BATCH_OUTPUT_FORMATS = ('.csv', '.parquet')
+
+
+def _read_redshift_chunks(path: str, column: str = 'z', chunk_size: int = BATCH_CHUNK_SIZE):
+    """
+    Yields the redshifts stored in a CSV, NPY or Parquet file in chunks of at most
+    `chunk_size` values, so the whole catalog is never held in memory.
+
+    Args:
+        path (str): The input file. NPY files hold a 1-d array of redshifts, CSV and
+            Parquet files a column named `column`.
+        column (str): The redshift column of CSV and Parquet files.
+        chunk_size (int): Maximum number of redshifts per chunk.
+
+    Yields:
+        np.ndarray: The next chunk of redshifts.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        zs = np.load(path, mmap_mode='r')
+        for start in range(0, len(zs), chunk_size):
+            yield np.asarray(zs[start:start + chunk_size], dtype=float)
+    elif extension == '.csv':
+        import pandas as pd
+        for chunk in pd.read_csv(path, usecols=[column], chunksize=chunk_size):
+            yield chunk[column].to_numpy(dtype=float)
+    elif extension == '.parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=[column]):
+            yield batch.column(0).to_numpy(zero_copy_only=False).astype(float)
+    else:
+        raise ValueError(f'Unsupported input format {extension}, use .csv, .npy or .parquet')
+
+
+class _ChunkWriter:
+    """
+    Appends chunks of results to a CSV or Parquet file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.extension = os.path.splitext(path)[1].lower()
+        if self.extension not in BATCH_OUTPUT_FORMATS:
+            raise ValueError(f'Unsupported output format {self.extension}, use .csv or .parquet')
+        self._parquet_writer = None
+        self._first = True
+
+    def write(self, columns: dict):
+        if self.extension == '.csv':
+            import pandas as pd
+            pd.DataFrame(columns).to_csv(self.path, mode='w' if self._first else 'a',
+                                         header=self._first, index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.table(columns)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        self._first = False
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+
+def annotate_catalog(input_path: str, output_path: str, cosmo: Cosmocalc, quantities=None,
+                     column: str = 'z', chunk_size: int = BATCH_CHUNK_SIZE):
+    """
+    Computes quantities for every redshift of a catalog, streaming it chunk by chunk.
+
+    Args:
+        input_path (str): CSV, NPY or Parquet file of redshifts.
+        output_path (str): CSV or Parquet file receiving the redshift and one column per quantity.
+        cosmo (Cosmocalc): The cosmology.
+        quantities (list, optional): Names taken from `result_quantities`. Defaults to all.
+        column (str): The redshift column of CSV and Parquet inputs.
+        chunk_size (int): Number of rows processed at a time, which bounds the memory use.
+
+    Returns:
+        dict: The number of rows, the elapsed time in seconds, the throughput in rows
+            per second and the peak resident memory in MB.
+    """
+    quantities = list(result_quantities if quantities is None else quantities)
+    unknown = [q for q in quantities if q not in result_quantities]
+    if unknown:
+        raise ValueError(f'Unsupported quantities: {unknown}')
+    start = time.perf_counter()
+    rows = 0
+    writer = _ChunkWriter(output_path)
+    try:
+        for zs in _read_redshift_chunks(input_path, column, chunk_size):
+            # chunks are evaluated directly, they are too many to keep in the shared cache
+            writer.write({column: zs, **cosmo._evaluate(zs, quantities)})
+            rows += len(zs)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    import resource
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_second': rows/elapsed if elapsed > 0 else float('inf'),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,
+    }
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m cosmocalc', description='Cosmology calculator')
+    commands = parser.add_subparsers(dest='command', required=True)
+    batch = commands.add_parser('batch', help='annotate a redshift catalog with cosmological quantities')
+    batch.add_argument('input', help='CSV, NPY or Parquet file of redshifts')
+    batch.add_argument('output', help='CSV or Parquet file to write')
+    batch.add_argument('--model', default='concordance', help='preset cosmology from cosmo_params.yaml')
+    for param in cosmo_input_params:
+        batch.add_argument(f'--{param}', type=float, help=f'{param}, overriding the preset')
+    batch.add_argument('--quantities', nargs='+', choices=result_quantities, help='defaults to all quantities')
+    batch.add_argument('--column', default='z', help='redshift column of CSV and Parquet inputs')
+    batch.add_argument('--chunk-size', type=int, default=BATCH_CHUNK_SIZE, help='rows processed at a time')
+    batch.add_argument('--tables', action='store_true', help='use the interpolation table mode')
+    batch.add_argument('--cache-dir', help='directory of the persistent table cache')
+    warm = commands.add_parser('warm-cache', help='build the persistent table cache for the preset cosmologies')
+    warm.add_argument('--cache-dir', help=f'defaults to $COSMOCALC_CACHE_DIR or {DEFAULT_DISK_CACHE_DIR}')
+    warm.add_argument('--accuracies', nargs='+', choices=list(ACCURACY_PROFILES), default=['display', 'standard'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'warm-cache':
+        stats = warm_disk_cache(args.cache_dir, accuracies=args.accuracies)
+        print(f"{stats['loaded']} entries loaded, {stats['built']} built in {disk_cache.directory}", file=sys.stderr)
+        return
+    if os.path.splitext(args.output)[1].lower() not in BATCH_OUTPUT_FORMATS:
+        parser.error(f'unsupported output format {args.output}, use one of {list(BATCH_OUTPUT_FORMATS)}')
+    if args.cache_dir:
+        disk_cache.directory = args.cache_dir
+
+    model_dict = load_config()['model_dict']
+    if args.model not in model_dict:
+        parser.error(f'unknown model {args.model}, choose one of {list(model_dict)}')
+    params = dict(model_dict[args.model]['param'])
+    params.update({p: getattr(args, p) for p in cosmo_input_params if getattr(args, p) is not None})
+    cosmo = Cosmocalc(*[float(params[p]) for p in cosmo_input_params])
+    if args.tables:
+        cosmo.enable_tables()
+    stats = annotate_catalog(args.input, args.output, cosmo, args.quantities, args.column, args.chunk_size)
+    print(f"{stats['rows']} rows in {stats['seconds']:.2f} s ({stats['rows_per_second']:.0f} rows/s), "
+          f"peak memory {stats['peak_memory_mb']:.0f} MB", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
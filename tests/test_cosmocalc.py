@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+import pytest
+
+from benchmark_cosmocalc import EXTRA_CASES, ReferenceCosmocalc
+from cosmocalc import (ACCURACY_PROFILES, Cosmocalc, DiskCache, SupernovaLikelihood, cosmo_input_params,
+                       invertible_quantities, result_quantities)
+from verify_accuracy import CLOSED_FORM_CASES
+
+CONCORDANCE = (70, -1, 0, 0, 0.3, 0.7)
+CLOSED = (70, -1, 0, 0, 0.5, 0.7)
+# cosmologies without closed forms: closed, open, and evolving dark energy with radiation
+NUMERICAL = [tuple(case[p] for p in cosmo_input_params) for case in EXTRA_CASES.values()]
+REDSHIFTS = np.geomspace(1e-3, 1e3, 25)
+
+
+@pytest.mark.parametrize('accuracy', list(ACCURACY_PROFILES))
+@pytest.mark.parametrize('params', NUMERICAL)
+def test_profiles_meet_their_tolerance_against_quad(accuracy, params):
+    expected = ReferenceCosmocalc(*params).evaluate(REDSHIFTS)
+    results = Cosmocalc(*params, accuracy=accuracy).evaluate(REDSHIFTS)
+    for quantity in result_quantities:
+        np.testing.assert_allclose(results[quantity], expected[quantity], rtol=ACCURACY_PROFILES[accuracy]['rtol'],
+                                   atol=0, err_msg=quantity)
+
+
+@pytest.mark.parametrize('accuracy', list(ACCURACY_PROFILES))
+@pytest.mark.parametrize('params', [params for cases in CLOSED_FORM_CASES.values() for params in cases])
+def test_closed_forms_match_numerical_integrals(accuracy, params):
+    z = np.append(REDSHIFTS, np.inf)
+    # limits like the volume element's r^2/E at z = infinity are nan on both paths
+    with np.errstate(invalid='ignore'):
+        closed_form = Cosmocalc(*params, accuracy=accuracy).evaluate(z)
+        numerical = Cosmocalc(*params, force_numerical=True, accuracy=accuracy).evaluate(z)
+    for quantity in result_quantities:
+        assert not np.any(np.isnan(numerical[quantity]) & ~np.isnan(closed_form[quantity])), quantity
+        np.testing.assert_allclose(numerical[quantity], closed_form[quantity],
+                                   rtol=ACCURACY_PROFILES[accuracy]['rtol'], atol=0, err_msg=quantity)
+
+
+@pytest.mark.parametrize('params', [CONCORDANCE, CLOSED] + NUMERICAL)
+@pytest.mark.parametrize('quantity', invertible_quantities)
+def test_z_at_round_trips(params, quantity):
+    cosmo = Cosmocalc(*params)
+    z = np.geomspace(1e-3, 100, 50)
+    np.testing.assert_allclose(cosmo.z_at(quantity, getattr(cosmo, quantity)(z)), z, rtol=1e-8)
+
+
+@pytest.mark.parametrize('marginalize', [False, True])
+@pytest.mark.parametrize('correlated', [False, True])
+def test_supernova_chi2_matches_brute_force(marginalize, correlated):
+    rng = np.random.default_rng(0)
+    n = 300
+    z = rng.uniform(0.01, 2, n)
+    errors = rng.uniform(0.1, 0.2, n)
+    cov = np.diag(errors**2)
+    if correlated:
+        systematics = 0.05*rng.standard_normal((n, 5))
+        cov += systematics @ systematics.T
+    mu = Cosmocalc(*CONCORDANCE).distance_modulus(z) + 0.3 + rng.multivariate_normal(np.zeros(n), cov)
+    likelihood = SupernovaLikelihood(z, mu, cov if correlated else errors**2, Cosmocalc(*CONCORDANCE),
+                                     marginalize=marginalize)
+    params = {'H0': 68.0, 'omega_M': 0.31, 'w': -0.95, 'omega_Lambda': 0.65}
+    residuals = mu - Cosmocalc(*[params.get(p, v) for p, v in zip(cosmo_input_params, CONCORDANCE)]).distance_modulus(z)
+    inverse = np.linalg.inv(cov)
+    if marginalize:
+        # -2 ln of the likelihood integrated over a constant offset of the distance moduli
+        offsets, step = np.linspace(-2, 2, 4001, retstep=True)
+        shifted = residuals - offsets[:, None]
+        chi2 = np.sum((shifted @ inverse)*shifted, axis=1)
+        expected = chi2.min() - 2*np.log(step*np.sum(np.exp(-(chi2 - chi2.min())/2)))
+    else:
+        expected = residuals @ inverse @ residuals
+    assert likelihood.chi2(**params) == pytest.approx(expected, rel=1e-7)
+
+
+@pytest.mark.parametrize('params', [CONCORDANCE, CLOSED])
+@pytest.mark.parametrize('z_min, z_max', [(0, 1), (0, 10), (0.5, 3)])
+def test_draw_redshifts_follows_comoving_volume(params, z_min, z_max):
+    cosmo = Cosmocalc(*params)
+    n = 10_000_000
+    zs = np.sort(cosmo.draw_redshifts(n, z_min, z_max, seed=1))
+    assert zs[0] >= z_min and zs[-1] <= z_max
+    # counts below redshifts down to the low-z tail, against the analytic fraction of the volume
+    cuts = z_min + (z_max - z_min)*np.geomspace(3e-3, 0.9, 15)
+    volumes = cosmo.comoving_volume(np.array([z_min, z_max]))
+    expected = n*(cosmo.comoving_volume(cuts) - volumes[0])/(volumes[1] - volumes[0])
+    counts = np.searchsorted(zs, cuts)
+    assert np.all(np.abs(counts - expected) < 5*np.sqrt(expected*(1 - expected/n)) + 1)
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    arrays = {'a': np.random.default_rng(0).random(10_000)}
+    cache.get_or_compute('first', lambda: arrays)
+    cache.max_bytes = 3*os.path.getsize(next(tmp_path.iterdir()))
+    for key, age in zip(['first', 'second', 'third'], [20, 30, 10]):
+        cache.get_or_compute(key, lambda: arrays)
+        os.utime(tmp_path/f'{cache._digest(key)}.npz', (0, 1e9 - age))
+    cache.get_or_compute('first', lambda: arrays)  # a hit marks it as recently used
+    cache.get_or_compute('fourth', lambda: arrays)
+    assert {path.name for path in tmp_path.iterdir()} == {f'{cache._digest(key)}.npz' for key in ['first', 'third', 'fourth']}
+    assert (cache.hits, cache.misses) == (2, 4)
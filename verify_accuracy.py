@@ -0,0 +1,126 @@
+"""
+Checks the actual error of every Cosmocalc accuracy profile against a high-precision
+reference, over random cosmologies drawn from the parameter ranges of input_param_dict
+in cosmo_params.yaml.
+
+    python verify_accuracy.py --samples 50
+
+For each profile and quantity the largest relative error found is printed next to the
+profile's target. The closed forms are checked as well, for a few cosmologies that have
+them, against the numerical integrals of the 'precision' profile. The script exits with
+status 1 if any profile or closed form misses its target. Cosmologies whose integrals are
+not finite up to the largest redshift (e.g. closed universes that turn around) are skipped.
+"""
+import argparse
+import sys
+
+import numpy as np
+
+import cosmocalc
+from cosmocalc import ACCURACY_PROFILES, Cosmocalc, cosmo_input_params, result_quantities
+from benchmark_cosmocalc import ReferenceCosmocalc, max_relative_error
+
+# H0 only scales the results, so its range is narrowed to avoid the degenerate H0 = 0
+H0_RANGE = (20.0, 200.0)
+# omega_rad is drawn log-uniformly from OMEGA_RAD_MIN up to its maximum, so that realistic
+# densities around 1e-4, which a uniform draw up to 1 almost never gives, are covered
+OMEGA_RAD_MIN = 1e-6
+REDSHIFTS = np.geomspace(1e-3, 1e3, 25)
+# the closed forms are checked up to z = infinity too
+CLOSED_FORM_REDSHIFTS = np.append(REDSHIFTS, np.inf)
+# cosmologies with closed forms, by the key in cosmocalc.closed_forms they must use
+CLOSED_FORM_CASES = {
+    'flat_lambda_cdm': [(70.0, -1, 0, 0, 0.3, 0.7), (70.0, -1, 0, 0, 1.0, 0.0), (70.0, -1, 0, 0, 1.2, -0.2)],
+    'empty': [(70.0, -1, 0, 0, 0.0, 0.0)],
+}
+
+
+def parameter_ranges(path: str = cosmocalc.PARAMS_FILE):
+    input_param_dict = cosmocalc.load_config(path)['input_param_dict']
+    ranges = {p: (float(input_param_dict[p]['min']), float(input_param_dict[p]['max'])) for p in cosmo_input_params}
+    ranges['H0'] = H0_RANGE
+    return ranges
+
+
+def sample_cosmologies(n: int, seed: int = 0, z_max: float = REDSHIFTS[-1]):
+    """
+    Returns n parameter sets drawn uniformly from the parameter ranges, omega_rad
+    log-uniformly, keeping only those with a positive expansion rate up to z_max.
+    """
+    rng = np.random.default_rng(seed)
+    ranges = parameter_ranges()
+    samples = []
+    while len(samples) < n:
+        values = [rng.uniform(*ranges[p]) for p in cosmo_input_params]
+        values[cosmo_input_params.index('omega_rad')] = np.exp(rng.uniform(
+            np.log(OMEGA_RAD_MIN), np.log(ranges['omega_rad'][1])))
+        with np.errstate(invalid='ignore'):
+            expansion = Cosmocalc(*values)._E(np.geomspace(1e-4, z_max, 1000))
+        if np.all(np.isfinite(expansion)):
+            samples.append(values)
+    return samples
+
+
+def verify(samples, profiles=tuple(ACCURACY_PROFILES), z=REDSHIFTS):
+    """
+    Returns, for each profile and quantity, the largest relative error over all samples.
+    The closed forms are switched off so that the profiles' quadrature is what is measured.
+    """
+    errors = {profile: dict.fromkeys(result_quantities, 0.0) for profile in profiles}
+    for values in samples:
+        reference = ReferenceCosmocalc(*values)
+        for profile in profiles:
+            calc = Cosmocalc(*values, force_numerical=True, accuracy=profile)
+            for quantity in result_quantities:
+                error = max_relative_error(calc, reference, quantity, z)
+                if error is not None:
+                    errors[profile][quantity] = max(errors[profile][quantity], error)
+    return errors
+
+
+def verify_closed_forms(cases=CLOSED_FORM_CASES, z=CLOSED_FORM_REDSHIFTS):
+    """
+    Returns, for each cosmology of `cases`, the largest relative difference of every quantity
+    between the closed forms and the numerical integrals of the 'precision' profile.
+
+    Raises:
+        ValueError: If a cosmology is not sent to the closed form it is listed under.
+    """
+    errors = {}
+    for closed_form, cosmologies in cases.items():
+        for values in cosmologies:
+            calc = Cosmocalc(*values)
+            if calc.closed_form != closed_form:
+                raise ValueError(f'{values} uses the closed form {calc.closed_form}, expected {closed_form}')
+            numerical = Cosmocalc(*values, force_numerical=True, accuracy='precision')
+            errors[values] = {q: max_relative_error(calc, numerical, q, z) or 0.0 for q in result_quantities}
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=20, help='number of random cosmologies')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profiles', nargs='+', choices=list(ACCURACY_PROFILES), default=list(ACCURACY_PROFILES))
+    args = parser.parse_args(argv)
+
+    errors = verify(sample_cosmologies(args.samples, args.seed), args.profiles)
+    failed = False
+    for profile, quantities in errors.items():
+        target = ACCURACY_PROFILES[profile]['rtol']
+        for quantity, error in quantities.items():
+            status = 'ok' if error <= target else 'FAILED'
+            failed |= error > target
+            print(f'{profile:>10} {quantity:<26} max error {error:.2e} target {target:.0e} {status}')
+    target = ACCURACY_PROFILES['precision']['rtol']
+    for values, quantities in verify_closed_forms().items():
+        error = max(quantities.values())
+        status = 'ok' if error <= target else 'FAILED'
+        failed |= error > target
+        print(f'closed form {values} max difference {error:.2e} target {target:.0e} {status}')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()